@@ -0,0 +1,229 @@
+"""
+Measure how build, run and gather scale with synthetic sweeps.
+
+Each phase is executed in its own process, whose wall time, CPU time,
+peak RSS and block I/O are recorded together with the number (and size)
+of files it created. The script exits with a non-zero status if a phase
+fails or, with ``--compare``, is slower than the given measurements (failed
+phases are not compared).
+
+    $ python benchmarks/benchmark.py --sizes 10 --sizes 1000 -o results.json
+    $ python benchmarks/benchmark.py --compare results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import itertools
+import subprocess
+
+import click
+import yaml
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = ['build', 'run', 'gather']
+
+# exec commands creating the result files of each environment
+RESULTS = {
+    'few': 'mkdir -p out && echo {x} > out/result.txt',
+    'many': ('mkdir -p out && for i in $(seq 100); '
+             'do echo {x} > out/result_$i.txt; done'),
+    'large': 'mkdir -p out && head -c 10485760 /dev/zero > out/result.bin'
+}
+
+
+def make_base_config(kind):
+    if kind == 'small':
+        return {'x': 0, 'message': 'hello'}
+    if kind == 'deep':
+        config = {'value': 0}
+        for i in range(50):
+            config = {f'level_{i}': config, f'sibling_{i}': i}
+        return {'x': 0, 'nested': config}
+    if kind == 'large':
+        config = {f'param_{i}': [i, str(i), {'weight': i / 2}]
+                  for i in range(10000)}
+        return {'x': 0, **config}
+    raise ValueError(kind)
+
+
+def setup_sweep(path, size, base_config, results):
+    os.makedirs(os.path.join(path, 'project'))
+    with open(os.path.join(path, 'project', 'model.py'), 'w') as fd:
+        fd.write('print("hello")\n')
+
+    with open(os.path.join(path, 'base_config.yaml'), 'w') as fd:
+        yaml.safe_dump(make_base_config(base_config), fd)
+
+    config = {
+        'project_source': 'project',
+        'working_dir': 'sweep',
+        'base_config': 'base_config.yaml',
+        'exec_command': [RESULTS[results]],
+        'result_files': ['out'],
+        'config_parameters': [{'key': 'x', 'values': list(range(size))}]
+    }
+    with open(os.path.join(path, 'config.yaml'), 'w') as fd:
+        yaml.safe_dump(config, fd)
+
+
+def count_files(path):
+    count = size = 0
+    for root, _, files in os.walk(path):
+        for fname in files:
+            fpath = os.path.join(root, fname)
+            if not os.path.islink(fpath):
+                count += 1
+                size += os.path.getsize(fpath)
+    return count, size
+
+
+def measure(cmd, cwd):
+    env = {**os.environ, 'PYTHONPATH': ROOT}
+    before = count_files(cwd)
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        cmd, cwd=cwd, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                       else -os.WTERMSIG(status))
+
+    after = count_files(cwd)
+    return {
+        'exit_code': proc.returncode,
+        'wall_time': wall,
+        'cpu_time': usage.ru_utime + usage.ru_stime,
+        'peak_rss_mb': usage.ru_maxrss / 1024,  # KB on Linux
+        'blocks_read': usage.ru_inblock,
+        'blocks_written': usage.ru_oublock,
+        'files_created': after[0] - before[0],
+        'bytes_written': after[1] - before[1]
+    }
+
+
+def run_scenario(scenario, jobs, phases, keep):
+    path = tempfile.mkdtemp(prefix='project_manager_benchmark_')
+    try:
+        setup_sweep(
+            path, scenario['size'], scenario['base_config'],
+            scenario['results'])
+
+        measurements = {}
+        for phase in phases:
+            cmd = [sys.executable, '-m', 'project_manager', phase,
+                   '--jobs', str(jobs)]
+            measurements[phase] = measure(cmd, path)
+        return measurements
+    finally:
+        if keep:
+            print(f'Kept sweep in "{path}"')
+        else:
+            shutil.rmtree(path)
+
+
+def get_name(scenario):
+    return (f'size={scenario["size"]},base_config={scenario["base_config"]},'
+            f'results={scenario["results"]}')
+
+
+@click.command()
+@click.option(
+    '--sizes', '-n', multiple=True, type=int, default=[10, 100, 1000],
+    show_default=True, help='Number of environments (repeatable).')
+@click.option(
+    '--base-config', '-b', 'base_configs', multiple=True,
+    type=click.Choice(['small', 'deep', 'large']), default=['small'],
+    show_default=True, help='Kind of base config (repeatable).')
+@click.option(
+    '--results', '-r', 'results', multiple=True,
+    type=click.Choice(list(RESULTS)), default=['few'], show_default=True,
+    help='Result files of each environment (repeatable).')
+@click.option(
+    '--phase', '-p', 'phases', multiple=True, type=click.Choice(PHASES),
+    default=PHASES, show_default=True, help='Phases to measure.')
+@click.option(
+    '--jobs', '-j', default=1, type=int, show_default=True,
+    help='Value of --jobs for each phase.')
+@click.option(
+    '--output', '-o', default=None, type=click.Path(dir_okay=False),
+    help='Store measurements as JSON.')
+@click.option(
+    '--compare', default=None, type=click.Path(exists=True, dir_okay=False),
+    help='Fail if slower than the measurements in this JSON file.')
+@click.option(
+    '--tolerance', default=1.5, type=float, show_default=True,
+    help='Allowed slowdown factor when comparing.')
+@click.option(
+    '--keep', default=False, is_flag=True,
+    help='Keep generated sweeps.')
+def main(
+    sizes, base_configs, results, phases, jobs, output, compare, tolerance,
+    keep
+):
+    scenarios = [
+        {'size': size, 'base_config': base_config, 'results': results_}
+        for size, base_config, results_ in itertools.product(
+            sizes, base_configs, results)]
+
+    report = {}
+    for scenario in scenarios:
+        name = get_name(scenario)
+        print(name)
+
+        report[name] = run_scenario(scenario, jobs, phases, keep)
+        for phase, m in report[name].items():
+            print(f' > {phase:6} {m["wall_time"]:8.2f}s wall '
+                  f'{m["cpu_time"]:8.2f}s cpu '
+                  f'{m["peak_rss_mb"]:8.1f} MB rss '
+                  f'{m["files_created"]:8} files '
+                  f'{m["bytes_written"] / 2**20:8.1f} MB written'
+                  + ('' if m['exit_code'] == 0
+                     else f' (exit code {m["exit_code"]})'))
+
+    if output is not None:
+        with open(output, 'w') as fd:
+            json.dump(report, fd, indent=1)
+
+    failures = [
+        f'{name} {phase}: exit code {m["exit_code"]}'
+        for name, phases_ in report.items()
+        for phase, m in phases_.items() if m['exit_code'] != 0]
+
+    # guard against regressions, timings of failed phases are meaningless
+    regressions = []
+    if compare is not None:
+        with open(compare) as fd:
+            baseline = json.load(fd)
+
+        for name, phases_ in report.items():
+            for phase, m in phases_.items():
+                old = baseline.get(name, {}).get(phase)
+                if m['exit_code'] == 0 and old is not None and (
+                    m['wall_time'] > old['wall_time'] * tolerance
+                ):
+                    regressions.append(
+                        f'{name} {phase}: {m["wall_time"]:.2f}s '
+                        f'(baseline {old["wall_time"]:.2f}s)')
+
+    if len(failures) > 0:
+        print('Failures:')
+        for failure in failures:
+            print(f' - {failure}')
+    if len(regressions) > 0:
+        print('Regressions:')
+        for regression in regressions:
+            print(f' - {regression}')
+    if len(failures) > 0 or len(regressions) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+from .main import cli
+
+
+if __name__ == '__main__':
+    cli()
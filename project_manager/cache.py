@@ -0,0 +1,210 @@
+"""
+Content-addressed cache of result files.
+
+Results are stored under a hash of the project source (git commit or file
+tree), the generated config and the formatted commands of an environment.
+Entries are tracked in an SQLite database and evicted in least recently
+used order once the cache exceeds its size limit.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import sqlite3
+import contextlib
+import subprocess
+
+from .utils import SOURCE_NAME, hash_file
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+def get_cache_dir(config):
+    return os.path.expanduser(config['cache']['path'])
+
+
+@contextlib.contextmanager
+def connect(cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+
+    db = sqlite3.connect(os.path.join(cache_dir, 'cache.sqlite'), timeout=60)
+    try:
+        db.execute(SCHEMA)
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+def get_object_dir(cache_dir, key):
+    return os.path.join(cache_dir, 'objects', key[:2], key)
+
+
+def hash_tree(path):
+    sha = hashlib.sha1()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != '.git')
+        for fname in sorted(files):
+            fpath = os.path.join(root, fname)
+            sha.update(os.path.relpath(fpath, path).encode())
+            sha.update(hash_file(fpath).encode())
+    return sha.hexdigest()
+
+
+def get_commit(env_path):
+    # environments cloned from git are identified by their commit
+    proc = subprocess.run(
+        ['git', 'rev-parse', 'HEAD'], cwd=env_path,
+        capture_output=True, text=True, check=True)
+    return proc.stdout.strip()
+
+
+def write_source_info(env_path, source_info):
+    # git sources are identified by the commit checked out in the
+    # environment
+    source_info = dict(source_info)
+    source_info['commit'] = None
+    if os.path.isdir(os.path.join(env_path, '.git')):
+        source_info['commit'] = get_commit(env_path)
+
+    with open(os.path.join(env_path, SOURCE_NAME), 'w') as fd:
+        json.dump(source_info, fd)
+
+
+def read_source_info(env_path):
+    try:
+        with open(os.path.join(env_path, SOURCE_NAME)) as fd:
+            return json.load(fd)
+    except FileNotFoundError:
+        return None
+
+
+def get_key(source_info, config_path, commands, result_files):
+    with open(config_path, 'rb') as fd:
+        config_hash = hashlib.sha1(fd.read()).hexdigest()
+
+    data = json.dumps(
+        [source_info, config_hash, commands, result_files], sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def _copy(src, dst):
+    if os.path.lexists(dst):
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            shutil.rmtree(dst)
+        else:
+            os.remove(dst)
+
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+def _get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, fname))
+        for root, _, files in os.walk(path)
+        for fname in files)
+
+
+def restore(cache_dir, key, env_path, result_files):
+    """Copy cached results into `env_path`, returns whether they existed."""
+    object_dir = get_object_dir(cache_dir, key)
+    if not os.path.isdir(object_dir):
+        return False
+
+    # the entry might be evicted concurrently, so it is only used if it
+    # still exists after copying
+    try:
+        for res_file in result_files:
+            _copy(os.path.join(object_dir, res_file),
+                  os.path.join(env_path, res_file))
+    except OSError:
+        return False
+
+    with connect(cache_dir) as db:
+        cur = db.execute(
+            'UPDATE entries SET last_used = ?, hits = hits + 1 '
+            'WHERE key = ?', (time.time(), key))
+        return cur.rowcount > 0
+
+
+def store(cache_dir, key, env_path, result_files, max_size=None):
+    # incomplete results are not cached
+    if not all(os.path.exists(os.path.join(env_path, res_file))
+               for res_file in result_files):
+        return False
+
+    # copy to temporary location first, so entries appear atomically
+    tmp_dir = os.path.join(cache_dir, 'tmp', uuid.uuid4().hex)
+    for res_file in result_files:
+        _copy(os.path.join(env_path, res_file),
+              os.path.join(tmp_dir, res_file))
+    os.makedirs(tmp_dir, exist_ok=True)
+    size = _get_size(tmp_dir)
+
+    object_dir = get_object_dir(cache_dir, key)
+    os.makedirs(os.path.dirname(object_dir), exist_ok=True)
+    try:
+        os.rename(tmp_dir, object_dir)
+    except OSError:
+        # stored concurrently
+        shutil.rmtree(tmp_dir)
+
+    now = time.time()
+    with connect(cache_dir) as db:
+        db.execute(
+            'INSERT OR REPLACE INTO entries (key, size, created, last_used) '
+            'VALUES (?, ?, ?, ?)', (key, size, now, now))
+
+    if max_size is not None:
+        prune(cache_dir, max_size)
+    return True
+
+
+def stats(cache_dir):
+    with connect(cache_dir) as db:
+        count, size, hits, oldest = db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0), '
+            'COALESCE(SUM(hits), 0), MIN(last_used) FROM entries').fetchone()
+    return {'entries': count, 'size': size, 'hits': hits,
+            'oldest_use': oldest}
+
+
+def prune(cache_dir, max_size):
+    """Evict least recently used entries until at most `max_size` bytes
+    remain, returns the evicted keys."""
+    evicted = []
+    with connect(cache_dir) as db:
+        total = db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        for key, size in db.execute(
+            'SELECT key, size FROM entries ORDER BY last_used'
+        ).fetchall():
+            if total <= max_size:
+                break
+            db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            evicted.append(key)
+            total -= size
+
+        # remove objects before other processes can store them again
+        for key in evicted:
+            shutil.rmtree(
+                get_object_dir(cache_dir, key), ignore_errors=True)
+    return evicted
@@ -1,6 +1,32 @@
-from .build import main as build
-from .run import main as run
-from .gather import main as gather
+"""
+Commands are imported lazily, so that each of them only loads the
+dependencies it needs.
+"""
 
+import importlib
+
+
+_COMMANDS = {
+    'build': ('build', 'main'),
+    'run': ('run', 'main'),
+    'gather': ('gather', 'main'),
+    'status': ('status', 'main'),
+    'search': ('search', 'main'),
+    'cache_stats': ('cache', 'stats'),
+    'cache_prune': ('cache', 'prune')
+}
+
+
+__all__ = list(_COMMANDS)
+
+
+def __getattr__(name):
+    if name not in _COMMANDS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    module_name, attr = _COMMANDS[name]
+    module = importlib.import_module(f'.{module_name}', __name__)
+    command = getattr(module, attr)
+    globals()[name] = command
+    return command
 
-__all__ = ['build', 'run', 'gather']
@@ -1,141 +1,253 @@
 import os
 import sys
-import copy
 import shutil
-import operator
 import functools
-import itertools
+import threading
 
 from pprint import pprint
+from concurrent.futures import ThreadPoolExecutor
 
 import sh
-import anyconfig
 from tqdm import tqdm
 
 from ..utils import (
-    SECTION_SEPARATOR,
-    PARAMETER_SEPARATOR,
-    NESTED_PARAMETER_SEPARATOR,
-    PARAMETER_ASSIGNMENT,
-    TEMP_CONFIG_NAME,
+    GIT_CACHE_DIR,
     load_config,
-    assign_to_dict,
-    dict_to_keyset
+    load_config_file,
+    dump_config_file,
+    get_config_name,
+    list_environments,
+    fingerprint,
+    copy_tree
 )
-
-
-def main(config_path: str, dry: bool = False):
-    config = load_config(config_path)
-    base_config = ({}
-                   if config['base_config'] is None
-                   else anyconfig.load(config['base_config']))
+from ..schedule import (
+    count_environments,
+    validate_schedule,
+    iter_environments,
+    get_parameters
+)
+from .. import index, profiling, cache
+
+
+def prepare_git_cache(
+    project_source: str, cache_dir: str, branches: list
+) -> dict:
+    # clone repository only once
+    repo_dir = os.path.join(cache_dir, 'repo.git')
+    if os.path.exists(repo_dir):
+        sh.git.fetch(
+            project_source, '+refs/heads/*:refs/heads/*', _cwd=repo_dir)
+    else:
+        sh.git.clone('--bare', project_source, repo_dir)
+
+    # check out each distinct branch once
+    checkouts = {}
+    for i, branch in enumerate(dict.fromkeys(branches)):
+        name = str(branch).replace('/', '_')
+        checkout_dir = os.path.join(cache_dir, 'checkouts', f'{i}_{name}')
+
+        if os.path.exists(checkout_dir):
+            # checkouts of older versions borrowed objects via alternates
+            alternates = os.path.join(
+                checkout_dir, '.git', 'objects', 'info', 'alternates')
+            if os.path.exists(alternates):
+                sh.git.repack('-a', '-d', _cwd=checkout_dir)
+                os.remove(alternates)
+
+            sh.git.fetch(
+                repo_dir, 'HEAD' if branch is None else branch,
+                _cwd=checkout_dir)
+            sh.git.reset('--hard', 'FETCH_HEAD', _cwd=checkout_dir)
+        else:
+            # local clones hardlink objects, but unlike `--shared` clones,
+            # copies of the checkout do not depend on the cache
+            sh.git.clone(repo_dir, checkout_dir)
+            if branch is not None:
+                sh.git.checkout(branch, _cwd=checkout_dir)
+            sh.git.remote(
+                'set-url', 'origin', project_source, _cwd=checkout_dir)
+
+        checkouts[branch] = checkout_dir
+
+    return checkouts
+
+
+def setup_environment(
+    target_dir: str, source_dir: str, git_branch: str, cur_conf: dict,
+    config: dict, config_path: str, exec_dir: str, link_mode: str = 'copy',
+    profiler: profiling.Profiler = profiling.DISABLED,
+    source_info: dict = None
+) -> None:
+    name = os.path.basename(target_dir)
+
+    if source_dir is not None:
+        with profiler.phase('copy source', name) as record:
+            record['bytes'] = copy_tree(
+                source_dir, target_dir, link_mode=link_mode,
+                count_bytes=profiler.enabled)
+    else:
+        with profiler.phase('git clone', name):
+            sh.git.clone(config['project_source'], target_dir)
+
+    if git_branch is not None:
+        with profiler.phase('git checkout', name):
+            sh.git.checkout(git_branch, _cwd=target_dir)
+
+    # identify the code of the environment for the result cache
+    if source_info is not None:
+        with profiler.phase('source info', name):
+            cache.write_source_info(target_dir, source_info)
+
+    # the config must not be shared with the project source
+    with profiler.phase('dump config', name):
+        conf_path = os.path.join(target_dir, get_config_name(config))
+        if os.path.lexists(conf_path):
+            os.remove(conf_path)
+        dump_config_file(cur_conf, conf_path)
+
+    with profiler.phase('symlinks', name):
+        create_symlinks(target_dir, config, config_path, exec_dir)
+
+
+def create_symlinks(
+    target_dir: str, config: dict, config_path: str, exec_dir: str
+) -> None:
+    for sym in config['symlinks']:
+        sym_source = os.path.join(exec_dir, os.path.dirname(config_path), sym)
+        sym_path = os.path.relpath(sym_source, start=target_dir)
+        if not os.path.exists(os.path.join(target_dir, sym_path)):
+            print(f'Cannot find "{sym_path}"')
+
+        sym_base = os.path.basename(os.path.normpath(sym))
+
+        os.symlink(
+            sym_path, os.path.join(target_dir, sym_base),
+            target_is_directory=os.path.isdir(sym_source))
+
+
+def main(
+    config_path: str, dry: bool = False, jobs: int = 1,
+    git_cache: bool = False, link_mode: str = 'copy',
+    count: bool = False, start: int = None, stop: int = None,
+    incremental: bool = False, prune: bool = False, indices: list = None,
+    profile: bool = False, timings_path: str = None
+):
+    profiler = profiling.Profiler(
+        enabled=profile or timings_path is not None)
+
+    with profiler.phase('load config'):
+        config = load_config(config_path)
+
+    # only report size of schedule
+    if count:
+        print(count_environments(config, start=start, stop=stop))
+        return
+
+    with profiler.phase('load config'):
+        base_config = ({}
+                       if config['base_config'] is None
+                       else load_config_file(config['base_config']))
+
+    # fail before creating any environment
+    total = count_environments(config, start=start, stop=stop)
+    if indices is not None:
+        total = len(indices) * config['extra_parameters']['repetitions']
+    if config['base_config'] is not None:
+        validate_schedule(config, base_config)
+
+    exec_dir = os.getcwd()
+    working_dir = os.path.join(exec_dir, config['working_dir'])
+
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+
+    if prune and (
+        not incremental or start is not None or stop is not None
+        or indices is not None
+    ):
+        print('Error: --prune requires --incremental and the full schedule.')
+        sys.exit(-1)
 
     # if needed prepare environment
-    if not dry:
-        if os.path.exists(config['working_dir']):
+    known = {}
+    existing = set()
+    if incremental and os.path.exists(working_dir):
+        existing = {entry.name for entry in list_environments(working_dir)}
+
+        if index.exists(working_dir):
+            known = index.get_fingerprints(working_dir)
+        else:
+            # adopt environments of builds without index as they are
+            print('No index found, keeping all existing environments.')
+            known = {name: None for name in existing}
+    elif not dry:
+        if os.path.exists(working_dir):
             print(f'Error: "{config["working_dir"]}" does already exist.')
             sys.exit(-1)
 
-        os.makedirs(config['working_dir'])
+        os.makedirs(working_dir)
 
-        exec_dir = os.getcwd()
-        os.chdir(config['working_dir'])
+    # locate project source
+    source_dir = os.path.join(exec_dir, config['project_source'])
+    if not os.path.isdir(source_dir):
+        source_dir = None
 
-    # setup and run schedule
-    special_extra_keys = ['repetitions']  # these get handled individually
-
-    config_schedule = []
-    for entry in config['config_parameters']:
-        tmp = []
-
-        # handle possible pairing
-        if 'paired' in entry:
-            # sanity checks
-            for e in entry['paired']:
-                if len(e['values']) != len(entry['values']):
-                    raise RuntimeError(
-                        f'Invalid pairing for "{entry["key"]}" & "{e["key"]}"')
-
-            # generate associations
-            paired_data = []
-            for i in range(len(entry['values'])):
-                case_values = [(c['key'], c['values'][i])
-                               for c in entry['paired']]
-
-                paired_data.append([{
-                    'key': key,
-                    'value': val
-                } for key, val in case_values])
-        else:
-            paired_data = [None] * len(entry['values'])
-
-        # add to schedule
-        for val, pair in zip(entry['values'], paired_data):
-            tmp.append(('config', entry['key'], val, pair))
-        config_schedule.append(tmp)
-
-    extra_schedule = [[('extra', k, v, None) for v in vs]
-                      for k, vs in config['extra_parameters'].items()
-                      if k not in special_extra_keys]
-    schedule = config_schedule + extra_schedule
-
-    for spec in tqdm(
-        itertools.product(*schedule),
-        total=functools.reduce(operator.mul, [len(s) for s in schedule], 1),
-        desc='Setting up environments'
-    ):
-        # create custom config
-        cur_conf = copy.deepcopy(base_config)
+    source_hash = None
+    if source_dir is not None and config.get('cache') is not None:
+        with profiler.phase('hash source'):
+            source_hash = cache.hash_tree(source_dir)
 
-        for t, k, v, p in spec:
-            if t != 'config':
-                continue
+    git_checkouts = {}
+    if source_dir is None and git_cache and not dry:
+        with profiler.phase('git cache'):
+            git_checkouts = prepare_git_cache(
+                config['project_source'],
+                os.path.join(working_dir, GIT_CACHE_DIR),
+                config['extra_parameters'].get('git_branch', [None]))
 
-            # set main parameter
-            assign_to_dict(cur_conf, k, v)
-
-            # set potential paired parameters
-            if p is not None:
-                for entry in p:
-                    k, v = entry['key'], entry['value']
-                    assign_to_dict(cur_conf, k, v)
-
-        # assert subset relation (so only valid keys are used)
-        if config['base_config'] is not None:
-            cur_keys = dict_to_keyset(cur_conf)
-            base_keys = dict_to_keyset(base_config)
-            if cur_keys != base_keys:
-                msg = 'Generated config is invalid.\n'
-
-                only_cur = cur_keys - base_keys
-                msg += 'Only in generated config:\n'
-                for k in only_cur:
-                    msg += f' > {k}\n'
-
-                raise RuntimeError(msg)
-
-        # make spec sortable
-        c = lambda x: (NESTED_PARAMETER_SEPARATOR.join(x)
-                       if isinstance(x, list)
-                       else x)  # noqa: E731
-        c2 = lambda x: str(x).replace('/', '_')  # noqa: E731
-
-        spec = [(t, c(k), v, p) for t, k, v, p in spec]
-
-        # extract extra info
-        extra_info = {k: v for t, k, v, p in sorted(spec) if t == 'extra'}
-        repetition_count = config['extra_parameters']['repetitions']
-
-        for rep in range(repetition_count):
-            # assemble index
-            idx = PARAMETER_SEPARATOR.join(
-                [f'{k}{PARAMETER_ASSIGNMENT}{c2(v)}'
-                 for t, k, v, p in sorted(spec)])
-            rep_app = (
-                f'{PARAMETER_SEPARATOR}repetition{PARAMETER_ASSIGNMENT}{rep+1}'
-                if repetition_count > 1
-                else '')
-            target_dir = f'run{SECTION_SEPARATOR}{idx}{rep_app}'
+    # setup and run schedule
+    pbar = tqdm(total=total, desc='Setting up environments')
+
+    # only keep a bounded number of environments in flight, rows are
+    # recorded as they finish
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    pending = threading.BoundedSemaphore(4 * jobs)
+    running = set()
+    errors = []
+    targets = set()
+    index_rows = []
+
+    def setup_done(future, row):
+        running.discard(future)
+        pending.release()
+        pbar.update()
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            errors.append(future.exception())
+        else:
+            index_rows.append(row)
+
+    try:
+        for target_dir, cur_conf, extra_info in iter_environments(
+            config, base_config, start=start, stop=stop, indices=indices
+        ):
+            targets.add(target_dir)
+
+            # skip environments which are up to date
+            env_fingerprint = fingerprint([cur_conf, extra_info])
+            parameters = get_parameters(config, cur_conf, extra_info)
+            if target_dir in existing:
+                if target_dir in known and known[target_dir] is None:
+                    index_rows.append(
+                        (target_dir, parameters, env_fingerprint))
+                if known.get(target_dir, '') in (None, env_fingerprint):
+                    pbar.update()
+                    continue
+
+                if not dry:
+                    tqdm.write(f'Updating changed "{target_dir}"')
+                    shutil.rmtree(os.path.join(working_dir, target_dir))
 
             # abort if in dry run
             if dry:
@@ -143,36 +255,58 @@ def main(config_path: str, dry: bool = False):
                 pprint(cur_conf)
                 pprint(extra_info)
                 print()
+                pbar.update()
                 continue
 
-            # setup environment
-            if os.path.isdir(
-                os.path.join(exec_dir, config['project_source'])
-            ):
-                shutil.copytree(
-                    os.path.join(exec_dir, config['project_source']),
-                    target_dir)
-            else:
-                sh.git.clone(config['project_source'], target_dir)
+            git_branch = extra_info.get('git_branch')
+            source_info = None
+            if config.get('cache') is not None:
+                source_info = {'tree': source_hash, 'git_branch': git_branch}
 
-            if 'git_branch' in extra_info:
-                sh.git.checkout(extra_info['git_branch'], _cwd=target_dir)
-
-            if config['base_config'] is not None:
-                conf_name = os.path.basename(config['base_config'])
+            if len(git_checkouts) > 0:
+                env_source = git_checkouts[git_branch]
+                git_branch = None
             else:
-                conf_name = TEMP_CONFIG_NAME
-            anyconfig.dump(cur_conf, f'{target_dir}/{conf_name}')
-
-            for sym in config['symlinks']:
-                sym_path = os.path.relpath(os.path.join(
-                    exec_dir, os.path.dirname(config_path), sym),
-                    start=target_dir)
-                if not os.path.exists(os.path.join(target_dir, sym_path)):
-                    print(f'Cannot find "{sym_path}"')
-
-                sym_base = os.path.basename(os.path.normpath(sym))
-
-                os.symlink(
-                    sym_path, os.path.join(target_dir, sym_base),
-                    target_is_directory=os.path.isdir(sym))
+                env_source = source_dir
+
+            pending.acquire()
+            if len(errors) > 0:
+                pending.release()
+                break
+
+            future = executor.submit(
+                setup_environment,
+                os.path.join(working_dir, target_dir),
+                env_source, git_branch, cur_conf,
+                config, config_path, exec_dir, link_mode, profiler,
+                source_info)
+            running.add(future)
+            future.add_done_callback(functools.partial(
+                setup_done, row=(target_dir, parameters, env_fingerprint)))
+
+        # wait for all environments to be created
+        executor.shutdown()
+    finally:
+        for future in list(running):
+            future.cancel()
+        executor.shutdown()
+        pbar.close()
+
+        if not dry:
+            index.add_environments(working_dir, index_rows)
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    # remove environments which are not part of the schedule anymore
+    if prune:
+        stale = sorted(existing - targets)
+        for name in stale:
+            print(f'Removing stale "{name}"')
+            if not dry:
+                shutil.rmtree(os.path.join(working_dir, name))
+
+        if not dry:
+            index.remove_environments(working_dir, stale)
+
+    profiler.finish('build', timings_path, summary=profile)
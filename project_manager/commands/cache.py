@@ -0,0 +1,41 @@
+import sys
+
+from datetime import datetime
+
+from ..utils import load_config
+from .. import cache
+
+
+def get_cache_dir(config: dict) -> str:
+    if config.get('cache') is None:
+        print('Error: config does not contain a "cache" section.')
+        sys.exit(-1)
+    return cache.get_cache_dir(config)
+
+
+def stats(config_path: str) -> None:
+    config = load_config(config_path)
+    cache_dir = get_cache_dir(config)
+
+    info = cache.stats(cache_dir)
+    print(f'location: {cache_dir}')
+    print(f'entries: {info["entries"]}')
+    print(f'size: {info["size"] / 2**20:.1f} MB')
+    print(f'hits: {info["hits"]}')
+    if info['oldest_use'] is not None:
+        oldest = datetime.fromtimestamp(info['oldest_use'])
+        print(f'least recently used: {oldest.isoformat(timespec="seconds")}')
+
+
+def prune(config_path: str, max_size: float = None) -> None:
+    config = load_config(config_path)
+    cache_dir = get_cache_dir(config)
+
+    if max_size is None:
+        max_size = config['cache'].get('max_size_mb')
+    if max_size is None:
+        print('Error: no size limit given.')
+        sys.exit(-1)
+
+    evicted = cache.prune(cache_dir, max_size * 2**20)
+    print(f'Evicted {len(evicted)} entries.')
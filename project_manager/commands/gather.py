@@ -1,53 +1,297 @@
 import os
+import sys
+import json
 import shutil
+import threading
 
-from ..utils import SECTION_SEPARATOR, load_config
+from concurrent.futures import ThreadPoolExecutor
 
+from ..utils import (
+    GATHER_MANIFEST_NAME,
+    load_config,
+    load_env_config,
+    get_config_name,
+    hash_file,
+    hardlink_file,
+    symlink_file
+)
+from ..schedule import get_parameters, parse_target_dir
+from ..tables import WRITERS, get_reader, write_table
+from .. import index, profiling
 
-def copy_file(idx: str, fname: str, target_dir: str, sub_dir: str = '.') -> None:
+
+def get_target_file(
+    idx: str, fname: str, target_dir: str, sub_dir: str = '.'
+) -> str:
     # assemble new filename
     raw_file, ext = os.path.splitext(fname)
     suf_file = os.path.basename(raw_file) + idx + ext
 
+    return os.path.join(target_dir, sub_dir, suf_file)
+
+
+def copy_file(
+    idx: str, fname: str, target_dir: str, sub_dir: str = '.',
+    created_dirs: set = None, link: str = 'copy'
+) -> None:
+    target_file = get_target_file(idx, fname, target_dir, sub_dir)
+
     # extract file
-    os.makedirs(os.path.join(target_dir, sub_dir), exist_ok=True)
-    shutil.copyfile(
-        fname,
-        os.path.join(target_dir, sub_dir, suf_file))
+    out_dir = os.path.dirname(target_file)
+    if created_dirs is None or out_dir not in created_dirs:
+        os.makedirs(out_dir, exist_ok=True)
+        if created_dirs is not None:
+            created_dirs.add(out_dir)
 
+    # never write through links of previous gathers
+    if os.path.lexists(target_file):
+        os.remove(target_file)
 
-def main(config_path: str, output: str) -> None:
-    config = load_config(config_path)
+    if link == 'hardlink':
+        hardlink_file(fname, target_file)
+    elif link == 'symlink':
+        symlink_file(fname, target_file)
+    else:
+        shutil.copyfile(fname, target_file)
 
-    if output is None:
-        target_dir = os.path.join(config['working_dir'], 'aggregated_results')
+
+def load_manifest(target_dir: str) -> dict:
+    try:
+        with open(os.path.join(target_dir, GATHER_MANIFEST_NAME)) as fd:
+            return json.load(fd)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(target_dir: str, manifest: dict) -> None:
+    manifest_path = os.path.join(target_dir, GATHER_MANIFEST_NAME)
+    with open(f'{manifest_path}.tmp', 'w') as fd:
+        json.dump(manifest, fd, indent=1, sort_keys=True)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+def is_unchanged(
+    entry: dict, old_entry: dict, target_file: str, use_hash: bool
+) -> bool:
+    if old_entry is None or not os.path.exists(target_file):
+        return False
+    if old_entry['source'] != entry['source']:
+        return False
+    if (old_entry['size'], old_entry['mtime']) == (
+        entry['size'], entry['mtime']
+    ):
+        return True
+
+    # metadata changed, but content might not have
+    if use_hash:
+        entry['hash'] = hash_file(entry['source'])
+        return entry['size'] == old_entry['size'] and (
+            entry['hash'] == old_entry.get('hash'))
+    return False
+
+
+def get_environment_parameters(config: dict, env: dict) -> dict:
+    parsed = parse_target_dir(env['name'])
+
+    if env['parameters'] is not None:
+        parameters = dict(env['parameters'])
     else:
-        target_dir = output
+        # working directory has no index
+        env_path = os.path.join(config['working_dir'], env['name'])
+        cur_conf = load_env_config(
+            os.path.join(env_path, get_config_name(config)))
+        extra_info = {k: parsed[k]
+                      for k in config['extra_parameters']
+                      if k in parsed}
+        parameters = get_parameters(config, cur_conf, extra_info)
+
+    if 'repetition' in parsed:
+        parameters['repetition'] = int(parsed['repetition'])
+    return parameters
+
+
+def get_environments(config: dict) -> list:
+    environments, missing = index.split_missing(
+        config['working_dir'], index.get_environments(config['working_dir']))
+    if len(missing) > 0:
+        print(f'Skipping {len(missing)} environments which do not '
+              f'exist anymore:')
+        for env in missing:
+            print(f' - {env["name"]}')
+    return environments
 
-    shutil.rmtree(target_dir, ignore_errors=True)
-    os.makedirs(target_dir)
 
+def iter_table_rows(config: dict, environments: list):
     # iterate over individual pipeline runs
-    for entry in os.scandir(config['working_dir']):
-        if not entry.name.startswith(f'run{SECTION_SEPARATOR}'):
-            continue
-        print(entry.name)
-        idx = entry.name[3:]
+    for env in environments:
+        print(env['name'])
+        parameters = get_environment_parameters(config, env)
+        env_path = os.path.join(config['working_dir'], env['name'])
 
         # iterate over requested result files
         for res_file_ in config['result_files']:
-            res_path = os.path.join(entry.path, res_file_)
+            res_path = os.path.join(env_path, res_file_)
 
             if os.path.isfile(res_path):
-                print(f' > {res_file_}')
-                copy_file(
-                    idx, res_path, target_dir,
-                    sub_dir=os.path.dirname(res_file_))
+                files = [(res_file_, res_path)]
             elif os.path.isdir(res_path):
-                for file_ in os.scandir(res_path):
-                    print(f' > {os.path.join(res_file_, file_.name)}')
-                    copy_file(
-                        idx, file_.path, target_dir,
-                        sub_dir=res_file_)
+                files = [(os.path.join(res_file_, file_.name), file_.path)
+                         for file_ in sorted(
+                             os.scandir(res_path), key=lambda e: e.name)]
             else:
                 raise RuntimeError(f'Invalid file: "{res_path}"')
+
+            for name, path in files:
+                reader = get_reader(path)
+                if reader is None:
+                    print(f' > {name} (no reader, skipped)')
+                    continue
+
+                print(f' > {name}')
+                for data in reader(path):
+                    yield {**parameters, 'result_file': name, **data}
+
+
+def main(
+    config_path: str, output: str, jobs: int = 1,
+    incremental: bool = False, use_hash: bool = False,
+    format_: str = 'files', table_type: str = 'csv', link: str = 'copy',
+    profile: bool = False, timings_path: str = None
+) -> None:
+    profiler = profiling.Profiler(
+        enabled=profile or timings_path is not None)
+
+    with profiler.phase('load config'):
+        config = load_config(config_path)
+
+    if output is None:
+        target_dir = os.path.join(config['working_dir'], 'aggregated_results')
+    else:
+        target_dir = output
+
+    # combine all results into a single table
+    if format_ == 'table':
+        if incremental:
+            print('Error: tables cannot be gathered incrementally.')
+            sys.exit(-1)
+
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.makedirs(target_dir)
+
+        ext, _ = WRITERS[table_type]
+        with profiler.phase('write table'):
+            write_table(
+                iter_table_rows(config, get_environments(config)),
+                os.path.join(target_dir, f'results{ext}'),
+                table_type=table_type)
+        profiler.finish('gather', timings_path, summary=profile)
+        return
+
+    if incremental:
+        old_manifest = load_manifest(target_dir)
+        os.makedirs(target_dir, exist_ok=True)
+    else:
+        old_manifest = {}
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.makedirs(target_dir)
+    manifest = {}
+
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+
+    # copies are streamed into the pool, but at most a few per worker are
+    # queued at any time
+    pending = threading.BoundedSemaphore(4 * jobs)
+    errors = []
+    created_dirs = set()
+
+    def copy_done(future):
+        pending.release()
+        if future.exception() is not None:
+            errors.append(future.exception())
+
+    def timed_copy(env_name, size, *args, **kwargs):
+        with profiler.phase('copy', env_name) as record:
+            copy_file(*args, **kwargs)
+            if link == 'copy':
+                record['bytes'] = size
+
+    def submit_copy(executor, env_name, display_name, idx, fname, sub_dir):
+        target_file = get_target_file(idx, fname, target_dir, sub_dir)
+        rel_target = os.path.relpath(target_file, target_dir)
+
+        # skip files which did not change since the last gather
+        stat = os.stat(fname)
+        entry = {
+            'source': fname,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns
+        }
+        if use_hash:
+            entry['hash'] = None
+
+        old_entry = old_manifest.get(rel_target)
+        if incremental and is_unchanged(
+            entry, old_entry, target_file, use_hash
+        ):
+            manifest[rel_target] = {
+                **old_entry,
+                **{k: v for k, v in entry.items() if v is not None}}
+            return
+
+        if use_hash and entry['hash'] is None:
+            entry['hash'] = hash_file(fname)
+        manifest[rel_target] = entry
+
+        print(f' > {display_name}')
+        pending.acquire()
+        future = executor.submit(
+            timed_copy, env_name, entry['size'],
+            idx, fname, target_dir, sub_dir,
+            created_dirs=created_dirs, link=link)
+        future.add_done_callback(copy_done)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # iterate over individual pipeline runs
+        for env in get_environments(config):
+            print(env['name'])
+            idx = env['name'][3:]
+            env_path = os.path.join(config['working_dir'], env['name'])
+
+            # iterate over requested result files
+            for res_file_ in config['result_files']:
+                res_path = os.path.join(env_path, res_file_)
+
+                if os.path.isfile(res_path):
+                    submit_copy(
+                        executor, env['name'], res_file_, idx, res_path,
+                        os.path.dirname(res_file_))
+                elif os.path.isdir(res_path):
+                    for file_ in sorted(
+                        os.scandir(res_path), key=lambda e: e.name
+                    ):
+                        submit_copy(
+                            executor, env['name'],
+                            os.path.join(res_file_, file_.name),
+                            idx, file_.path, res_file_)
+                elif incremental:
+                    # results of running environments may not exist yet
+                    print(f' > {res_file_} (missing)')
+                else:
+                    raise RuntimeError(f'Invalid file: "{res_path}"')
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    # remove results whose source is gone
+    for rel_target in sorted(old_manifest.keys() - manifest.keys()):
+        print(f'Removing "{rel_target}"')
+        target_file = os.path.join(target_dir, rel_target)
+        if os.path.lexists(target_file):
+            os.remove(target_file)
+
+    # only incremental gathers need to know what was copied
+    if incremental:
+        save_manifest(target_dir, manifest)
+
+    profiler.finish('gather', timings_path, summary=profile)
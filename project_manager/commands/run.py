@@ -1,38 +1,494 @@
 import os
+import sys
+import signal
+import asyncio
+import hashlib
+import threading
+import contextlib
+
+from datetime import datetime
 
-import anyconfig
 from tqdm import tqdm
 
-from ..utils import SECTION_SEPARATOR, TEMP_CONFIG_NAME, load_config
+from ..utils import (
+    LOG_NAME,
+    load_config,
+    load_env_config,
+    get_config_name,
+    read_status,
+    write_status,
+    claim_environment,
+    release_environment,
+    fingerprint
+)
+from .. import index, executors, resources, workers, cache, profiling
+
+
+LOG_CHUNK_SIZE = 2**16
+
+
+def timestamp() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def is_selected(
+    env: dict, command_fingerprint: str,
+    resume: bool = True, only_failed: bool = False
+) -> bool:
+    if only_failed:
+        # interrupted runs count as failed
+        return env['status'] in ('failed', 'running')
+    if resume:
+        return not (env['status'] == 'success' and
+                    env.get('command_fingerprint') == command_fingerprint)
+    return True
+
+
+def record_status(path: str, status: dict, use_index: bool) -> None:
+    write_status(path, status)
+    if use_index:
+        index.update_status(
+            os.path.dirname(path), os.path.basename(path), status)
+
+
+def get_command_fingerprint(config: dict) -> str:
+    if config.get('python_entry') is None:
+        return fingerprint(config['exec_command'])
+    return fingerprint([config['exec_command'], config['python_entry']])
+
+
+def get_commands(config: dict) -> list:
+    # commands are either plain strings or objects with options
+    commands = []
+    for cmd in config['exec_command']:
+        if isinstance(cmd, str):
+            cmd = {'cmd': cmd}
+        commands.append({
+            'timeout': None, 'retries': 0, 'retry_delay': 1, **cmd})
+    return commands
+
+
+def get_cache_info(config: dict) -> dict:
+    max_size = config['cache'].get('max_size_mb')
+    return {
+        'dir': cache.get_cache_dir(config),
+        'max_size': None if max_size is None else max_size * 2**20
+    }
+
+
+def get_cache_key(path: str, config: dict, cur_config: dict) -> str:
+    # the source is recorded by `build`, environments built without cache
+    # are not cached
+    source_info = cache.read_source_info(path)
+    if source_info is None:
+        return None
+
+    commands = [command['cmd'].format(**cur_config)
+                for command in get_commands(config)]
+    if config.get('python_entry') is not None:
+        commands.append(config['python_entry'])
+
+    return cache.get_key(
+        source_info, os.path.join(path, get_config_name(config)),
+        commands, config['result_files'])
+
+
+def kill_process(proc) -> None:
+    # also kill children of the shell
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+
+async def pump_output(stream, log_fd) -> None:
+    # output is copied in chunks, so memory usage stays bounded
+    while True:
+        chunk = await stream.read(LOG_CHUNK_SIZE)
+        if not chunk:
+            break
+        log_fd.write(chunk)
+        log_fd.flush()
+
+
+async def run_command(
+    cmd: str, cwd: str, env: dict, log_fd, timeout: float = None
+) -> int:
+    proc = await asyncio.create_subprocess_shell(
+        cmd, cwd=cwd, env=env,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True)
+    pump = asyncio.ensure_future(pump_output(proc.stdout, log_fd))
+
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        kill_process(proc)
+        await proc.wait()
+        await pump
+        log_fd.write(f'Timed out after {timeout}s\n'.encode())
+        return proc.returncode
+    except BaseException:
+        # interrupted
+        kill_process(proc)
+        raise
+
+    await pump
+    return proc.returncode
+
+
+async def run_environment(
+    path: str, config: dict, dry: bool = False, use_index: bool = False,
+    gpu_ids: list = None, pool=None, cache_info: dict = None,
+    profiler: profiling.Profiler = profiling.DISABLED
+) -> int:
+    name = os.path.basename(path)
+    loop = asyncio.get_event_loop()
+
+    # blocking calls (files, index) must not stall the event loop, which
+    # drives the commands of all environments
+    def run_blocking(func, *args):
+        return loop.run_in_executor(None, func, *args)
+
+    # load config
+    with profiler.phase('load config', name):
+        cur_config = await run_blocking(
+            load_env_config, os.path.join(path, get_config_name(config)))
+
+    status = {
+        'status': 'running',
+        'exit_code': None,
+        'started': timestamp(),
+        'finished': None,
+        'command_fingerprint': get_command_fingerprint(config),
+        'commands': []
+    }
+    if not dry:
+        await run_blocking(record_status, path, status, use_index)
+
+    # restore results of an identical previous run
+    cache_key = None
+    if cache_info is not None and not dry:
+        with profiler.phase('cache restore', name):
+            cache_key = await run_blocking(
+                get_cache_key, path, config, cur_config)
+            restored = cache_key is not None and await run_blocking(
+                cache.restore,
+                cache_info['dir'], cache_key, path, config['result_files'])
+
+        if restored:
+            tqdm.write(f'{name} > restored results from cache')
+            status.update({
+                'status': 'success',
+                'exit_code': 0,
+                'finished': timestamp(),
+                'cached': True
+            })
+            await run_blocking(record_status, path, status, use_index)
+            return 0
+
+    env = None
+    if gpu_ids is not None:
+        env = {**os.environ, 'CUDA_VISIBLE_DEVICES': ','.join(gpu_ids)}
+
+    # execute commands (abort at first failure)
+    exit_code = 0
+    with contextlib.ExitStack() as stack:
+        if not dry:
+            log_fd = stack.enter_context(
+                open(os.path.join(path, LOG_NAME), 'wb'))
 
+        for command in get_commands(config):
+            cmd_mod = command['cmd'].format(**cur_config)
+            status['commands'].append(cmd_mod)
 
-def main(config_path: str, dry: bool):
-    config = load_config(config_path)
+            tqdm.write(f'{name} > {cmd_mod}')
+            if dry:
+                continue
 
-    for entry in tqdm(
-        os.scandir(config['working_dir']),
-        total=len(os.listdir(config['working_dir']))
-    ):
-        if not entry.name.startswith(f'run{SECTION_SEPARATOR}'):
-            continue
+            for attempt in range(command['retries'] + 1):
+                if attempt > 0:
+                    # back off exponentially
+                    delay = command['retry_delay'] * 2**(attempt - 1)
+                    tqdm.write(
+                        f'{name} > retrying in {delay}s '
+                        f'(attempt {attempt + 1}/{command["retries"] + 1})')
+                    await asyncio.sleep(delay)
 
-        # switch to correct directory
-        print(entry.name)
-        wd = os.getcwd()
-        os.chdir(entry.path)
+                log_fd.write(f'$ {cmd_mod}\n'.encode())
+                log_fd.flush()
+                with profiler.phase('command', name) as record:
+                    # usage of children is only known once they finished
+                    cpu_start = profiler.children_cpu_time()
+                    exit_code = await run_command(
+                        cmd_mod, path, env, log_fd,
+                        timeout=command['timeout'])
+                    if profiler.exclusive and cpu_start is not None:
+                        record['cpu_time'] = (
+                            profiler.children_cpu_time() - cpu_start)
+                if exit_code == 0:
+                    break
 
-        # load config
-        conf_name = (TEMP_CONFIG_NAME
-                     if config['base_config'] is None
-                     else os.path.basename(config['base_config']))
-        cur_config = anyconfig.load(conf_name)
+            if exit_code != 0:
+                break
 
-        # execute commands
-        for cmd in config['exec_command']:
-            cmd_mod = cmd.format(**cur_config)
+        # call python entry point in a persistent worker
+        entry = config.get('python_entry')
+        if entry is not None and exit_code == 0:
+            status['commands'].append(entry)
 
-            print(f' > {cmd_mod}')
+            tqdm.write(f'{name} > {entry}')
             if not dry:
-                os.system(cmd_mod)
+                log_fd.write(f'$ {entry}\n'.encode())
+                log_fd.flush()
+                with profiler.phase('python_entry', name):
+                    exit_code = await workers.submit(
+                        pool, entry, path, cur_config,
+                        os.path.join(path, LOG_NAME), gpu_ids)
+
+    if cache_key is not None and exit_code == 0:
+        with profiler.phase('cache store', name):
+            await run_blocking(
+                cache.store, cache_info['dir'], cache_key, path,
+                config['result_files'], cache_info['max_size'])
+
+    status.update({
+        'status': 'success' if exit_code == 0 else 'failed',
+        'exit_code': exit_code,
+        'finished': timestamp()
+    })
+    if not dry:
+        await run_blocking(record_status, path, status, use_index)
+
+    return exit_code
+
+
+async def run_claimed(
+    path: str, config: dict, dry: bool, use_index: bool, seen_started: str,
+    resume: bool = True, only_failed: bool = False, gpu_ids: list = None,
+    pool=None, cache_info: dict = None,
+    profiler: profiling.Profiler = profiling.DISABLED
+) -> int:
+    loop = asyncio.get_event_loop()
+    if not await loop.run_in_executor(None, claim_environment, path):
+        return None
+
+    try:
+        # environment might have been run by another worker in the meantime,
+        # which changed its status since it was selected (timestamps of
+        # different hosts are not compared, as their clocks might differ)
+        status = await loop.run_in_executor(None, read_status, path)
+        if status is not None and (
+            status.get('started') != seen_started or not is_selected(
+                status, get_command_fingerprint(config),
+                resume=resume, only_failed=only_failed)
+        ):
+            return None
+
+        return await run_environment(
+            path, config, dry, use_index, gpu_ids, pool, cache_info,
+            profiler)
+    finally:
+        await loop.run_in_executor(None, release_environment, path)
+
+
+@contextlib.contextmanager
+def event_loop():
+    # a single event loop drives all subprocesses, while the caller
+    # schedules them from the main thread
+    loop = asyncio.new_event_loop()
+
+    # before Python 3.8, subprocesses can only be watched if the child
+    # watcher is attached to the loop from the main thread
+    watcher = None
+    if sys.version_info < (3, 8):
+        watcher = asyncio.SafeChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def cancel_all():
+        tasks = [task for task in asyncio.all_tasks()
+                 if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    try:
+        yield loop
+    finally:
+        asyncio.run_coroutine_threadsafe(cancel_all(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        if watcher is not None:
+            asyncio.set_child_watcher(None)
+            watcher.close()
+        loop.close()
+
+
+def in_shard(name: str, shard: tuple) -> bool:
+    shard_index, shard_count = shard
+    name_hash = int(hashlib.sha1(name.encode()).hexdigest(), 16)
+    return name_hash % shard_count == shard_index - 1
+
+
+def main(
+    config_path: str, dry: bool, jobs: int = 1,
+    resume: bool = False, only_failed: bool = False,
+    executor: str = 'local', batch_size: int = 1, scheduler_args: str = '',
+    task_file: str = None, task_index: int = None,
+    shard: tuple = None, claim: bool = False,
+    max_cpus: float = None, max_mem: float = None, max_gpus: int = None,
+    worker_tasks: int = 100, names: list = None, check: bool = True,
+    use_cache: bool = True, profile: bool = False, timings_path: str = None
+) -> dict:
+    # subprocess CPU time cannot be attributed if several run concurrently
+    profiler = profiling.Profiler(
+        enabled=profile or timings_path is not None,
+        exclusive=jobs == 1)
+
+    with profiler.phase('load config'):
+        config = load_config(config_path)
+    command_fingerprint = get_command_fingerprint(config)
+    use_index = index.exists(config['working_dir'])
+
+    # concurrent workers drain the working directory once
+    if claim:
+        resume = True
+
+    # skip completed environments
+    with profiler.phase('select environments'):
+        selected = [
+            env for env in index.get_environments(config['working_dir'])
+            if is_selected(
+                env, command_fingerprint,
+                resume=resume, only_failed=only_failed)
+            and (shard is None or in_shard(env['name'], shard))
+            and (names is None or env['name'] in names)
+        ]
+
+        selected, missing = index.split_missing(
+            config['working_dir'], selected)
+        if len(missing) > 0:
+            print(f'Skipping {len(missing)} environments which do not '
+                  f'exist anymore:')
+            for env in missing:
+                print(f' - {env["name"]}')
+
+        seen_started = {env['name']: env.get('started') for env in selected}
+        environments = list(seen_started)
+
+    # only handle environments of a single job array task
+    if task_file is not None:
+        tasks = set(executors.read_tasks(task_file, task_index, batch_size))
+        environments = [name for name in environments if name in tasks]
+
+    # submit to cluster scheduler
+    if executor != 'local':
+        active = executors.get_active_environments(config['working_dir'])
+        environments = [name for name in environments if name not in active]
+
+        if len(environments) == 0:
+            print('No environments to submit.')
+            return
+
+        # array tasks select and execute environments like this call
+        run_args = ['--jobs', str(jobs), '--worker-tasks', str(worker_tasks)]
+        for flag, value in [
+            ('--resume', resume), ('--only-failed', only_failed),
+            ('--claim', claim), ('--no-cache', not use_cache)
+        ]:
+            if value:
+                run_args.append(flag)
+        for option, value in [
+            ('--max-cpus', max_cpus), ('--max-mem', max_mem),
+            ('--max-gpus', max_gpus)
+        ]:
+            if value is not None:
+                run_args += [option, str(value)]
+
+        job_id = executors.submit(
+            executor, config_path, config['working_dir'], environments,
+            batch_size=batch_size, scheduler_args=scheduler_args, dry=dry,
+            run_args=run_args)
+        if job_id is not None:
+            print(f'Submitted {len(environments)} environments '
+                  f'as job {job_id}')
+        return
+
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+
+    # determine resource requirements
+    limits = resources.get_default_limits()
+    for key, value in [
+        ('cpus', max_cpus), ('mem_mb', max_mem), ('gpus', max_gpus)
+    ]:
+        if value is not None:
+            limits[key] = value
+
+    resource_config = config.get('resources', {})
+    with profiler.phase('resources'):
+        if resources.has_expressions(resource_config):
+            tasks = [
+                (name, resources.get_requirements(
+                    resource_config,
+                    load_env_config(os.path.join(
+                        config['working_dir'], name,
+                        get_config_name(config)))))
+                for name in environments]
+        else:
+            requirements = resources.get_requirements(resource_config)
+            tasks = [(name, requirements) for name in environments]
+
+    cache_info = None
+    if use_cache and config.get('cache') is not None and not dry:
+        cache_info = get_cache_info(config)
+
+    exit_codes = {}
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if config.get('python_entry') is not None and not dry:
+            pool = workers.create_pool(jobs, worker_tasks)
+            stack.callback(pool.terminate)
+        loop = stack.enter_context(event_loop())
+
+        def submit(name, gpu_ids):
+            path = os.path.join(config['working_dir'], name)
+            if claim:
+                coro = run_claimed(
+                    path, config, dry, use_index, seen_started[name],
+                    resume=resume, only_failed=only_failed, gpu_ids=gpu_ids,
+                    pool=pool, cache_info=cache_info, profiler=profiler)
+            else:
+                coro = run_environment(
+                    path, config, dry, use_index, gpu_ids, pool, cache_info,
+                    profiler)
+            return asyncio.run_coroutine_threadsafe(coro, loop)
+
+        for name, exit_code in tqdm(
+            resources.schedule(tasks, limits, jobs, submit),
+            total=len(tasks), desc='Running environments'
+        ):
+            if exit_code is not None:
+                exit_codes[name] = exit_code
+
+    profiler.finish('run', timings_path, summary=profile)
+
+    # report failed jobs
+    failed = {name: code for name, code in sorted(exit_codes.items())
+              if code != 0}
+    if len(failed) > 0 and check:
+        print(f'{len(failed)}/{len(exit_codes)} environments failed:')
+        for name, code in failed.items():
+            print(f' - {name} (exit code {code})')
+        sys.exit(-1)
 
-        os.chdir(wd)
+    return exit_codes
@@ -0,0 +1,200 @@
+import os
+import sys
+import math
+import random
+import operator
+import functools
+
+from ..utils import load_config
+from ..schedule import (
+    format_key,
+    get_dimensions,
+    get_spec,
+    get_spec_index,
+    get_target_dir,
+    get_target_dirs
+)
+from ..tables import get_reader
+from .build import main as build_environments
+from .run import main as run_environments
+
+
+def read_objective(env_path: str, objective: dict) -> float:
+    path = os.path.join(env_path, objective['file'])
+    if not os.path.isfile(path):
+        return None
+
+    # plain files contain a single number
+    if 'key' not in objective:
+        with open(path) as fd:
+            try:
+                return float(fd.read().strip())
+            except ValueError:
+                return None
+
+    reader = get_reader(path)
+    if reader is None:
+        raise RuntimeError(f'No reader for "{objective["file"]}"')
+
+    # use last reported value (e.g. of a training log)
+    value = None
+    for row in reader(path):
+        if row.get(objective['key']) is not None:
+            value = row[objective['key']]
+    return None if value is None else float(value)
+
+
+def sample_random(rng, lengths: list, count: int) -> list:
+    return [[rng.randrange(length) for length in lengths]
+            for _ in range(count)]
+
+
+def sample_lhs(rng, lengths: list, count: int) -> list:
+    # latin hypercube: each dimension is split into `count` strata, and
+    # every stratum is used exactly once
+    columns = []
+    for length in lengths:
+        strata = [int((i + rng.random()) / count * length)
+                  for i in range(count)]
+        rng.shuffle(strata)
+        columns.append(strata)
+    return [list(point) for point in zip(*columns)]
+
+
+SAMPLERS = {
+    'random': sample_random,
+    'lhs': sample_lhs
+}
+
+
+def sample(
+    rng, sampler, lengths: list, count: int, known: set,
+    fixed: dict = None
+) -> list:
+    """Sample up to `count` new points (lists of indices per dimension)."""
+    fixed = fixed or {}
+    free = [d for d in range(len(lengths)) if d not in fixed]
+    space_size = functools.reduce(
+        operator.mul, [lengths[d] for d in free], 1)
+    count = min(count, space_size - len(known))
+
+    # duplicates are rejected, so a few more attempts might be necessary
+    points = []
+    for _ in range(10):
+        missing = count - len(points)
+        if missing <= 0:
+            break
+
+        for values in sampler(rng, [lengths[d] for d in free], missing):
+            point = [None] * len(lengths)
+            for d, v in zip(free, values):
+                point[d] = v
+            for d, v in fixed.items():
+                point[d] = v
+
+            key = tuple(v for d, v in enumerate(point) if d not in fixed)
+            if key not in known:
+                known.add(key)
+                points.append(point)
+    return points
+
+
+def evaluate(config: dict, spec_idx: int) -> float:
+    # average objective over all repetitions (failed ones are ignored)
+    values = [
+        read_objective(
+            os.path.join(config['working_dir'], name),
+            config['search']['objective'])
+        for name in get_target_dirs(config, spec_idx)]
+    values = [v for v in values if v is not None and not math.isnan(v)]
+    return sum(values) / len(values) if len(values) > 0 else None
+
+
+def run_round(config_path: str, config: dict, indices: list, jobs: int):
+    names = [name
+             for spec_idx in indices
+             for name in get_target_dirs(config, spec_idx)]
+
+    build_environments(
+        config_path, jobs=jobs, incremental=True, indices=indices)
+    run_environments(
+        config_path, dry=False, jobs=jobs, resume=True, names=names,
+        check=False)
+
+    return {spec_idx: evaluate(config, spec_idx) for spec_idx in indices}
+
+
+def rank(results: dict, maximize: bool) -> list:
+    valid = [(v, idx) for idx, v in results.items() if v is not None]
+    valid.sort(key=lambda e: -e[0] if maximize else e[0])
+    return [(idx, v) for v, idx in valid]
+
+
+def main(config_path: str, jobs: int = 1, top: int = 5) -> None:
+    config = load_config(config_path)
+    if 'search' not in config:
+        print('Error: config does not contain a "search" section.')
+        sys.exit(-1)
+
+    search = config['search']
+    maximize = search['goal'] == 'maximize'
+    rng = random.Random(search['seed'])
+    dimensions = get_dimensions(config)
+    lengths = [length for length, _ in dimensions]
+
+    results = {}
+    if search['method'] == 'halving':
+        # the budget is a regular config parameter, so its environments are
+        # named like all others
+        budget_dims = [
+            d for d, entry in enumerate(config.get('config_parameters', []))
+            if format_key(entry['key']) == search.get('budget')]
+        if len(budget_dims) == 0:
+            print('Error: successive halving requires "budget" to be the '
+                  'key of a config parameter.')
+            sys.exit(-1)
+        budget_dim = budget_dims[0]
+
+        # start with many cheap runs and only continue the most promising
+        points = sample(
+            rng, sample_random, lengths, search['samples'], set(),
+            fixed={budget_dim: 0})
+        rung_count = lengths[budget_dim]
+        for rung in range(rung_count):
+            for point in points:
+                point[budget_dim] = rung
+            indices = [get_spec_index(dimensions, p) for p in points]
+
+            print(f'Rung {rung + 1}/{rung_count}: '
+                  f'{len(indices)} parameter combinations')
+            # objectives of different budgets are not comparable
+            results = run_round(config_path, config, indices, jobs)
+
+            keep = math.ceil(len(points) / search['eta'])
+            best = {idx for idx, _ in rank(results, maximize)[:keep]}
+            points = [p for p, idx in zip(points, indices) if idx in best]
+            if len(points) == 0:
+                break
+    else:
+        known = set()
+        for round_ in range(search['rounds']):
+            points = sample(
+                rng, SAMPLERS[search['method']], lengths,
+                search['samples'], known)
+            if len(points) == 0:
+                print('Parameter space exhausted.')
+                break
+
+            print(f'Round {round_ + 1}/{search["rounds"]}: '
+                  f'{len(points)} parameter combinations')
+            results.update(run_round(
+                config_path, config,
+                [get_spec_index(dimensions, p) for p in points], jobs))
+
+    # report best parameter combinations
+    ranking = rank(results, maximize)
+    print(f'Best {min(top, len(ranking))} of {len(results)} '
+          f'parameter combinations:')
+    for spec_idx, value in ranking[:top]:
+        name = get_target_dir(get_spec(dimensions, spec_idx))
+        print(f' - {name}: {value}')
@@ -0,0 +1,37 @@
+import collections
+
+from ..utils import load_config
+from .. import index, executors
+
+
+def main(config_path: str, list_: bool = False, status: str = None) -> None:
+    config = load_config(config_path)
+    environments = index.get_environments(
+        config['working_dir'], status=None if status == 'missing' else status)
+
+    # environments removed from disk are listed in the index nonetheless
+    _, missing = index.split_missing(config['working_dir'], environments)
+    for env in missing:
+        env.update({'status': 'missing', 'exit_code': None})
+    if status is not None:
+        environments = [
+            env for env in environments if env['status'] == status]
+
+    if list_:
+        for env in environments:
+            exit_code = ('' if env.get('exit_code') is None
+                         else f' (exit code {env["exit_code"]})')
+            print(f'{env["name"]}: {env["status"]}{exit_code}')
+        return
+
+    # summarize
+    counts = collections.Counter(env['status'] for env in environments)
+    for status_, count in sorted(counts.items()):
+        print(f'{status_}: {count}')
+    print(f'total: {len(environments)}')
+
+    # submitted cluster jobs
+    for job in executors.load_jobs(config['working_dir']):
+        state = 'active' if executors.is_active(job) else 'finished'
+        print(f'job {job["job_id"]} ({job["executor"]}, '
+              f'{job["environments"]} environments): {state}')
@@ -1,15 +1,19 @@
 import sys
-
-from jsonschema import validators
+import copy
+import functools
 
 
 def extend_with_default(validator_class):
+    from jsonschema import validators
+
     validate_properties = validator_class.VALIDATORS['properties']
 
     def set_defaults(validator, properties, instance, schema):
         for property, subschema in properties.items():
             if 'default' in subschema:
-                instance.setdefault(property, subschema['default'])
+                # the schema is shared, so configs get copies of defaults
+                instance.setdefault(
+                    property, copy.deepcopy(subschema['default']))
 
         for error in validate_properties(
             validator, properties, instance, schema,
@@ -20,11 +24,17 @@ def extend_with_default(validator_class):
         validator_class, {'properties': set_defaults})
 
 
-def validate_config(data, schema):
+def get_validator(schema):
+    # jsonschema is slow to import, so it is only loaded when needed
+    from jsonschema import validators
+
     Validator = validators.validator_for(schema)
     DefaultValidator = extend_with_default(Validator)
+    return DefaultValidator(schema)
+
 
-    v = DefaultValidator(schema)
+def validate_config(data, schema=None):
+    v = get_default_validator() if schema is None else get_validator(schema)
     if not v.is_valid(data):
         print('Invalid config:')
         for error in v.iter_errors(data):
@@ -35,73 +45,151 @@ def validate_config(data, schema):
     return data
 
 
-def main(data):
-    schema = {
-        'definitions': {
-            'config_items': {
-                'type': 'object',
-                'properties': {
-                    'key': {'type': ['string', 'array']},
-                    'values': {'type': 'array'},
-                    'paired': {
-                        'type': 'array',
-                        'items': {'$ref': '#/definitions/config_items'}
-                    }
-                },
-                'additionalProperties': False,
-                'required': ['key', 'values']
-            }
-        },
-
-        'type': 'object',
-        'properties': {
-            'project_source': {'type': 'string'},
-            'working_dir': {'type': 'string'},
-
-            'exec_command': {
-                'type': 'array',
-                'items': {'type': 'string'},
-                'default': []
+SCHEMA = {
+    'definitions': {
+        'config_items': {
+            'type': 'object',
+            'properties': {
+                'key': {'type': ['string', 'array']},
+                'values': {'type': 'array'},
+                'paired': {
+                    'type': 'array',
+                    'items': {'$ref': '#/definitions/config_items'}
+                }
             },
-            'result_files': {
-                'type': 'array',
-                'items': {'type': 'string'},
-                'default': []
+            'additionalProperties': False,
+            'required': ['key', 'values']
+        },
+        'command': {
+            'type': 'object',
+            'properties': {
+                'cmd': {'type': 'string'},
+                'timeout': {'type': 'number', 'exclusiveMinimum': 0},
+                'retries': {'type': 'integer', 'minimum': 0},
+                'retry_delay': {'type': 'number', 'minimum': 0}
             },
-            'symlinks': {
-                'type': 'array',
-                'items': {'type': 'string'},
-                'default': []
+            'additionalProperties': False,
+            'required': ['cmd']
+        }
+    },
+
+    'type': 'object',
+    'properties': {
+        'project_source': {'type': 'string'},
+        'working_dir': {'type': 'string'},
+
+        'exec_command': {
+            'type': 'array',
+            'items': {
+                'anyOf': [
+                    {'type': 'string'},
+                    {'$ref': '#/definitions/command'}
+                ]
             },
+            'default': []
+        },
+        'python_entry': {
+            'type': 'string',
+            'pattern': r'^[\w.]+:\w+$'
+        },
+        'result_files': {
+            'type': 'array',
+            'items': {'type': 'string'},
+            'default': []
+        },
+        'symlinks': {
+            'type': 'array',
+            'items': {'type': 'string'},
+            'default': []
+        },
 
-            'base_config': {
-                'type': ['string', 'null'],
-                'default': None
+        'base_config': {
+            'type': ['string', 'null'],
+            'default': None
+        },
+        'config_parameters': {
+            'type': 'array',
+            'items': {'$ref': '#/definitions/config_items'}
+        },
+        'resources': {
+            'type': 'object',
+            'properties': {
+                'cpus': {'type': ['number', 'string'], 'default': 1},
+                'mem_mb': {'type': ['number', 'string'], 'default': 0},
+                'gpus': {'type': ['integer', 'string'], 'default': 0}
             },
-            'config_parameters': {
-                'type': 'array',
-                'items': {'$ref': '#/definitions/config_items'}
+            'additionalProperties': False
+        },
+        'cache': {
+            'type': 'object',
+            'properties': {
+                'path': {'type': 'string'},
+                'max_size_mb': {'type': 'number', 'minimum': 0}
             },
-            'extra_parameters': {
-                'type': 'object',
-                'properties': {
-                    'git_branch': {
-                        'type': 'array'
+            'additionalProperties': False,
+            'required': ['path']
+        },
+        'search': {
+            'type': 'object',
+            'properties': {
+                'method': {
+                    'enum': ['random', 'lhs', 'halving'],
+                    'default': 'random'
+                },
+                'objective': {
+                    'type': 'object',
+                    'properties': {
+                        'file': {'type': 'string'},
+                        'key': {'type': 'string'}
                     },
-                    'repetitions': {
-                        'type': 'integer',
-                        'default': 1
-                    }
+                    'additionalProperties': False,
+                    'required': ['file']
+                },
+                'goal': {
+                    'enum': ['minimize', 'maximize'],
+                    'default': 'minimize'
+                },
+                'samples': {
+                    'type': 'integer', 'minimum': 1, 'default': 10
+                },
+                'rounds': {
+                    'type': 'integer', 'minimum': 1, 'default': 1
                 },
-                'additionalProperties': False,
-                'default': {'repetitions': 1}
-            }
+                'budget': {'type': 'string'},
+                'eta': {'type': 'integer', 'minimum': 2, 'default': 3},
+                'seed': {'type': 'integer', 'default': 0}
+            },
+            'additionalProperties': False,
+            'required': ['objective']
         },
-        'additionalProperties': False,
-        'required': ['project_source', 'working_dir', 'base_config']
-    }
+        'extra_parameters': {
+            'type': 'object',
+            'properties': {
+                'git_branch': {
+                    'type': 'array'
+                },
+                'repetitions': {
+                    'type': 'integer',
+                    'default': 1
+                }
+            },
+            'additionalProperties': False,
+            'default': {'repetitions': 1}
+        }
+    },
+    'additionalProperties': False,
+    'required': ['project_source', 'working_dir', 'base_config']
+}
+
 
-    return validate_config(data, schema)
+@functools.lru_cache(maxsize=None)
+def get_default_validator():
+    # building the validator class is expensive, so it is done only once
+    return get_validator(SCHEMA)
+
+
+def main(data):
+    return validate_config(data)
 
 
 if __name__ == '__main__':
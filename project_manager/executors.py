@@ -0,0 +1,181 @@
+"""
+Submit environments to cluster schedulers as job arrays.
+
+Each array task executes `project_manager run` for a batch of environments,
+which are read from a task file written at submission time.
+"""
+
+import os
+import re
+import sys
+import json
+import shlex
+import subprocess
+
+from datetime import datetime
+
+from .utils import JOBS_DIR
+
+
+SCHEDULERS = {
+    'slurm': {
+        'header': [
+            '#SBATCH --job-name=project_manager',
+            '#SBATCH --array=0-{last_task}',
+            '#SBATCH --output={log_dir}/%A_%a.log'
+        ],
+        'task_index': '$SLURM_ARRAY_TASK_ID',
+        'submit': ['sbatch', '{script}'],
+        'job_id': r'Submitted batch job (\d+)',
+        'query': ['squeue', '--noheader', '--jobs', '{job_id}'],
+    },
+    'pbs': {
+        'header': [
+            '#PBS -N project_manager',
+            '#PBS -J 0-{last_task}',
+            '#PBS -o {log_dir}',
+            '#PBS -j oe'
+        ],
+        'task_index': '$PBS_ARRAY_INDEX',
+        'submit': ['qsub', '{script}'],
+        'job_id': r'(\S+)',
+        'query': ['qstat', '{job_id}'],
+    },
+    'lsf': {
+        'header': [
+            '#BSUB -J "project_manager[1-{task_count}]"',
+            '#BSUB -o {log_dir}/%J_%I.log'
+        ],
+        # LSF array indices start at 1
+        'task_index': '$((LSB_JOBINDEX - 1))',
+        'submit': ['bsub'],  # reads script from stdin
+        'job_id': r'Job <(\d+)>',
+        'query': ['bjobs', '-noheader', '-o', 'stat', '{job_id}'],
+    }
+}
+
+
+def read_tasks(task_file: str, task_index: int, batch_size: int) -> list:
+    with open(task_file) as fd:
+        names = fd.read().splitlines()
+    return names[task_index * batch_size:(task_index + 1) * batch_size]
+
+
+def load_jobs(working_dir: str) -> list:
+    jobs_file = os.path.join(working_dir, JOBS_DIR, 'jobs.json')
+    if not os.path.exists(jobs_file):
+        return []
+
+    with open(jobs_file) as fd:
+        return json.load(fd)
+
+
+def save_jobs(working_dir: str, jobs: list) -> None:
+    jobs_file = os.path.join(working_dir, JOBS_DIR, 'jobs.json')
+    with open(f'{jobs_file}.tmp', 'w') as fd:
+        json.dump(jobs, fd, indent=1)
+    os.replace(f'{jobs_file}.tmp', jobs_file)
+
+
+def is_active(job: dict) -> bool:
+    # ask scheduler whether job is still queued or running
+    scheduler = SCHEDULERS[job['executor']]
+    cmd = [arg.format(job_id=job['job_id']) for arg in scheduler['query']]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+    except FileNotFoundError:
+        return False
+
+    if proc.returncode != 0:
+        return False
+    if job['executor'] == 'lsf':
+        return any(stat in proc.stdout for stat in ('PEND', 'RUN', 'SUSP'))
+    return len(proc.stdout.strip()) > 0
+
+
+def get_active_environments(working_dir: str) -> set:
+    active = set()
+    for job in load_jobs(working_dir):
+        if is_active(job):
+            with open(job['task_file']) as fd:
+                active.update(fd.read().splitlines())
+    return active
+
+
+def submit(
+    executor: str, config_path: str, working_dir: str, names: list,
+    batch_size: int = 1, scheduler_args: str = '', dry: bool = False,
+    run_args: list = None
+) -> str:
+    scheduler = SCHEDULERS[executor]
+    task_count = (len(names) + batch_size - 1) // batch_size
+
+    # each submission gets its own directory
+    job_dir = os.path.abspath(os.path.join(
+        working_dir, JOBS_DIR,
+        datetime.now().strftime('%Y%m%d-%H%M%S-%f')))
+    log_dir = os.path.join(job_dir, 'logs')
+    task_file = os.path.join(job_dir, 'tasks.txt')
+    script_file = os.path.join(job_dir, 'submit.sh')
+
+    # assemble job script
+    fmt = {
+        'last_task': task_count - 1,
+        'task_count': task_count,
+        'log_dir': log_dir
+    }
+    run_cmd = [
+        sys.executable, '-m', 'project_manager', 'run',
+        '--config', os.path.abspath(config_path),
+        '--task-file', task_file,
+        '--batch-size', str(batch_size)
+    ] + (run_args or [])
+    script = '\n'.join(
+        ['#!/bin/bash']
+        + [line.format(**fmt) for line in scheduler['header']]
+        + ['',
+           f'cd {shlex.quote(os.getcwd())}',
+           ' '.join(shlex.quote(arg) for arg in run_cmd)
+           + f' --task-index {scheduler["task_index"]}',
+           ''])
+
+    if dry:
+        print(script)
+        return None
+
+    os.makedirs(log_dir)
+    with open(task_file, 'w') as fd:
+        fd.write(''.join(f'{name}\n' for name in names))
+    with open(script_file, 'w') as fd:
+        fd.write(script)
+
+    # submit job array
+    cmd = [arg.format(script=script_file) for arg in scheduler['submit']]
+    cmd[1:1] = shlex.split(scheduler_args)
+
+    stdin = open(script_file) if executor == 'lsf' else None
+    try:
+        proc = subprocess.run(
+            cmd, stdin=stdin, capture_output=True, text=True, check=True)
+    finally:
+        if stdin is not None:
+            stdin.close()
+
+    match = re.search(scheduler['job_id'], proc.stdout)
+    if match is None:
+        raise RuntimeError(f'Cannot parse job id from "{proc.stdout}"')
+    job_id = match.group(1)
+
+    # keep track of submitted jobs
+    jobs = load_jobs(working_dir)
+    jobs.append({
+        'job_id': job_id,
+        'executor': executor,
+        'submitted': datetime.now().isoformat(timespec='seconds'),
+        'task_file': task_file,
+        'environments': len(names),
+        'tasks': task_count
+    })
+    save_jobs(working_dir, jobs)
+
+    return job_id
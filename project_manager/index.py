@@ -0,0 +1,119 @@
+"""
+SQLite index of the environments in a working directory.
+
+It is written by `build`, updated by `run` and allows querying the
+environments (and their status) without scanning the working directory.
+"""
+
+import os
+import json
+import sqlite3
+import contextlib
+
+from .utils import INDEX_PATH, list_environments, read_status
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS environments (
+    name TEXT PRIMARY KEY,
+    parameters TEXT,
+    config_fingerprint TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    exit_code INTEGER,
+    started TEXT,
+    finished TEXT,
+    command_fingerprint TEXT
+)
+"""
+
+STATUS_COLUMNS = [
+    'status', 'exit_code', 'started', 'finished', 'command_fingerprint']
+
+
+def exists(working_dir):
+    return os.path.exists(os.path.join(working_dir, INDEX_PATH))
+
+
+@contextlib.contextmanager
+def connect(working_dir):
+    path = os.path.join(working_dir, INDEX_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    db = sqlite3.connect(path, timeout=60)
+    db.row_factory = sqlite3.Row
+    try:
+        db.execute(SCHEMA)
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+def get_fingerprints(working_dir):
+    with connect(working_dir) as db:
+        return dict(db.execute(
+            'SELECT name, config_fingerprint FROM environments'))
+
+
+def add_environments(working_dir, rows):
+    # (re)created environments start out as pending
+    with connect(working_dir) as db:
+        db.executemany(
+            'INSERT OR REPLACE INTO environments '
+            '(name, parameters, config_fingerprint) VALUES (?, ?, ?)',
+            [(name, json.dumps(parameters, default=str), config_fingerprint)
+             for name, parameters, config_fingerprint in rows])
+
+
+def remove_environments(working_dir, names):
+    with connect(working_dir) as db:
+        db.executemany(
+            'DELETE FROM environments WHERE name = ?',
+            [(name,) for name in names])
+
+
+def update_status(working_dir, name, status):
+    with connect(working_dir) as db:
+        db.execute(
+            'UPDATE environments SET '
+            + ', '.join(f'{col} = ?' for col in STATUS_COLUMNS)
+            + ' WHERE name = ?',
+            [status[col] for col in STATUS_COLUMNS] + [name])
+
+
+def get_environments(working_dir, status=None):
+    if not exists(working_dir):
+        # fall back to scanning the working directory
+        environments = []
+        for entry in list_environments(working_dir):
+            env = {'name': entry.name, 'parameters': None, 'status': 'pending'}
+            env.update(read_status(entry.path) or {})
+            if status is None or env['status'] == status:
+                environments.append(env)
+        return environments
+
+    query = 'SELECT * FROM environments'
+    args = []
+    if status is not None:
+        query += ' WHERE status = ?'
+        args.append(status)
+    query += ' ORDER BY name'
+
+    with connect(working_dir) as db:
+        environments = []
+        for row in db.execute(query, args):
+            env = dict(row)
+            env['parameters'] = json.loads(env['parameters'])
+            environments.append(env)
+        return environments
+
+
+def split_missing(working_dir, environments):
+    # the index might list environments which were removed manually
+    existing, missing = [], []
+    for env in environments:
+        if os.path.isdir(os.path.join(working_dir, env['name'])):
+            existing.append(env)
+        else:
+            missing.append(env)
+    return existing, missing
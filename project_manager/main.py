@@ -7,6 +7,19 @@ And finally aggregate the obtained results using the `gather` command.
 import click
 
 
+def parse_shard(ctx, param, value):
+    if value is None:
+        return None
+
+    try:
+        shard_index, shard_count = map(int, value.split('/'))
+    except ValueError:
+        raise click.BadParameter('format must be I/N')
+    if not 1 <= shard_index <= shard_count:
+        raise click.BadParameter('I must be between 1 and N')
+    return shard_index, shard_count
+
+
 @click.group()
 def cli() -> None:
     """Automate multi-config simulation runs."""
@@ -20,9 +33,49 @@ def cli() -> None:
 @click.option(
     '--dry', '-d', default=False, is_flag=True,
     help='Conduct dry run.')
-def build(config_path: str, dry: bool) -> None:
-    from .commands import build as build_cmd
-    build_cmd(config_path, dry)
+@click.option(
+    '--jobs', '-j', default=1, type=int, show_default=True,
+    help='Number of environments to set up concurrently (0 uses all CPUs).')
+@click.option(
+    '--git-cache', default=False, is_flag=True,
+    help='Clone git sources once and create environments from local copies.')
+@click.option(
+    '--link-mode', default='copy', show_default=True,
+    type=click.Choice(['copy', 'hardlink', 'reflink', 'symlink-readonly']),
+    help='How to populate environments with the project\'s files.')
+@click.option(
+    '--count', default=False, is_flag=True,
+    help='Only print the number of environments.')
+@click.option(
+    '--start', default=None, type=int,
+    help='Index of first environment to set up.')
+@click.option(
+    '--stop', default=None, type=int,
+    help='Index after the last environment to set up.')
+@click.option(
+    '--incremental', '-i', default=False, is_flag=True,
+    help='Only create new or changed environments in existing working_dir.')
+@click.option(
+    '--prune', default=False, is_flag=True,
+    help='Remove environments which are not part of the schedule anymore.')
+@click.option(
+    '--profile', default=False, is_flag=True,
+    help='Print the slowest phases and environments.')
+@click.option(
+    '--timings-json', 'timings_path', default=None,
+    type=click.Path(dir_okay=False),
+    help='Store timings as JSON (or CSV if the name ends in .csv).')
+def build(
+    config_path: str, dry: bool, jobs: int, git_cache: bool, link_mode: str,
+    count: bool, start: int, stop: int, incremental: bool, prune: bool,
+    profile: bool, timings_path: str
+) -> None:
+    from .commands.build import main as build_cmd
+    build_cmd(
+        config_path, dry, jobs=jobs, git_cache=git_cache, link_mode=link_mode,
+        count=count, start=start, stop=stop,
+        incremental=incremental, prune=prune,
+        profile=profile, timings_path=timings_path)
 
 
 @cli.command(help='Run simulations in each environment.')
@@ -32,9 +85,75 @@ def build(config_path: str, dry: bool) -> None:
 @click.option(
     '--dry', '-d', default=False, is_flag=True,
     help='Conduct dry run.')
-def run(config_path: str, dry: bool) -> None:
-    from .commands import run as run_cmd
-    run_cmd(config_path, dry)
+@click.option(
+    '--jobs', '-j', default=1, type=int, show_default=True,
+    help='Number of environments to run concurrently (0 uses all CPUs).')
+@click.option(
+    '--resume/--force', default=False, show_default=True,
+    help='Skip environments which already completed successfully.')
+@click.option(
+    '--only-failed', default=False, is_flag=True,
+    help='Only rerun environments which failed or were interrupted.')
+@click.option(
+    '--executor', '-e', default='local', show_default=True,
+    type=click.Choice(['local', 'slurm', 'pbs', 'lsf']),
+    help='Run locally or submit a job array to a cluster scheduler.')
+@click.option(
+    '--batch-size', default=1, type=int, show_default=True,
+    help='Number of environments per job array task.')
+@click.option(
+    '--scheduler-args', default='',
+    help='Additional arguments for the submission command.')
+@click.option('--task-file', default=None, hidden=True)
+@click.option('--task-index', default=None, type=int, hidden=True)
+@click.option(
+    '--shard', default=None, callback=parse_shard, metavar='I/N',
+    help='Only run the I-th of N disjoint parts of all environments.')
+@click.option(
+    '--claim', default=False, is_flag=True,
+    help='Claim environments so that concurrent workers skip them '
+         '(implies --resume).')
+@click.option(
+    '--max-cpus', default=None, type=float,
+    help='CPUs available to concurrent environments [default: all].')
+@click.option(
+    '--max-mem', default=None, type=float,
+    help='Memory (in MB) available to concurrent environments '
+         '[default: all].')
+@click.option(
+    '--max-gpus', default=None, type=int,
+    help='GPUs available to concurrent environments '
+         '[default: CUDA_VISIBLE_DEVICES].')
+@click.option(
+    '--worker-tasks', default=100, show_default=True, type=int,
+    help='Number of environments after which python_entry workers '
+         'are restarted.')
+@click.option(
+    '--cache/--no-cache', 'use_cache', default=True, show_default=True,
+    help='Restore and store results using the cache (if configured).')
+@click.option(
+    '--profile', default=False, is_flag=True,
+    help='Print the slowest phases and environments.')
+@click.option(
+    '--timings-json', 'timings_path', default=None,
+    type=click.Path(dir_okay=False),
+    help='Store timings as JSON (or CSV if the name ends in .csv).')
+def run(
+    config_path: str, dry: bool, jobs: int, resume: bool, only_failed: bool,
+    executor: str, batch_size: int, scheduler_args: str,
+    task_file: str, task_index: int, shard: tuple, claim: bool,
+    max_cpus: float, max_mem: float, max_gpus: int, worker_tasks: int,
+    use_cache: bool, profile: bool, timings_path: str
+) -> None:
+    from .commands.run import main as run_cmd
+    run_cmd(
+        config_path, dry, jobs=jobs, resume=resume, only_failed=only_failed,
+        executor=executor, batch_size=batch_size,
+        scheduler_args=scheduler_args,
+        task_file=task_file, task_index=task_index, shard=shard, claim=claim,
+        max_cpus=max_cpus, max_mem=max_mem, max_gpus=max_gpus,
+        worker_tasks=worker_tasks, use_cache=use_cache,
+        profile=profile, timings_path=timings_path)
 
 
 @cli.command(help='Gather results from each run.')
@@ -45,9 +164,102 @@ def run(config_path: str, dry: bool) -> None:
     '--output', '-o', default=None,
     type=click.Path(exists=False, file_okay=False),
     help='Path to store aggregated results at.')
-def gather(config_path: str, output: str) -> None:
-    from .commands import gather as gather_cmd
-    gather_cmd(config_path, output)
+@click.option(
+    '--jobs', '-j', default=1, type=int, show_default=True,
+    help='Number of files to copy concurrently (0 uses all CPUs).')
+@click.option(
+    '--incremental', '-i', default=False, is_flag=True,
+    help='Only copy new or modified result files.')
+@click.option(
+    '--hash', 'use_hash', default=False, is_flag=True,
+    help='Compare file contents if size or modification time changed.')
+@click.option(
+    '--format', '-f', 'format_', default='files', show_default=True,
+    type=click.Choice(['files', 'table']),
+    help='Copy result files or combine their contents into one table.')
+@click.option(
+    '--table-type', default='csv', show_default=True,
+    type=click.Choice(['csv', 'parquet', 'hdf5']),
+    help='File format of table.')
+@click.option(
+    '--link', default='copy', show_default=True,
+    type=click.Choice(['copy', 'hardlink', 'symlink']),
+    help='How to place result files into the output directory.')
+@click.option(
+    '--profile', default=False, is_flag=True,
+    help='Print the slowest phases and environments.')
+@click.option(
+    '--timings-json', 'timings_path', default=None,
+    type=click.Path(dir_okay=False),
+    help='Store timings as JSON (or CSV if the name ends in .csv).')
+def gather(
+    config_path: str, output: str, jobs: int, incremental: bool,
+    use_hash: bool, format_: str, table_type: str, link: str,
+    profile: bool, timings_path: str
+) -> None:
+    from .commands.gather import main as gather_cmd
+    gather_cmd(
+        config_path, output, jobs=jobs, incremental=incremental,
+        use_hash=use_hash, format_=format_, table_type=table_type,
+        link=link, profile=profile, timings_path=timings_path)
+
+
+@cli.command(help='Show status of environments.')
+@click.option(
+    '--config', '-c', 'config_path', default='config.yaml',
+    type=click.Path(exists=True, dir_okay=False), help='Config file to use.')
+@click.option(
+    '--list', '-l', 'list_', default=False, is_flag=True,
+    help='List individual environments.')
+@click.option(
+    '--status', '-s', default=None,
+    type=click.Choice(
+        ['pending', 'running', 'success', 'failed', 'missing']),
+    help='Only consider environments with this status.')
+def status(config_path: str, list_: bool, status: str) -> None:
+    from .commands.status import main as status_cmd
+    status_cmd(config_path, list_=list_, status=status)
+
+
+@cli.command(help='Search parameter space adaptively.')
+@click.option(
+    '--config', '-c', 'config_path', default='config.yaml',
+    type=click.Path(exists=True, dir_okay=False), help='Config file to use.')
+@click.option(
+    '--jobs', '-j', default=1, type=int, show_default=True,
+    help='Number of environments to handle concurrently (0 uses all CPUs).')
+@click.option(
+    '--top', default=5, type=int, show_default=True,
+    help='Number of best parameter combinations to report.')
+def search(config_path: str, jobs: int, top: int) -> None:
+    from .commands.search import main as search_cmd
+    search_cmd(config_path, jobs=jobs, top=top)
+
+
+@cli.group(help='Manage the result cache.')
+def cache() -> None:
+    pass
+
+
+@cache.command(help='Show size and usage of the result cache.')
+@click.option(
+    '--config', '-c', 'config_path', default='config.yaml',
+    type=click.Path(exists=True, dir_okay=False), help='Config file to use.')
+def stats(config_path: str) -> None:
+    from .commands.cache import stats as cache_stats
+    cache_stats(config_path)
+
+
+@cache.command(help='Evict least recently used results.')
+@click.option(
+    '--config', '-c', 'config_path', default='config.yaml',
+    type=click.Path(exists=True, dir_okay=False), help='Config file to use.')
+@click.option(
+    '--max-size', default=None, type=float,
+    help='Size (in MB) to shrink the cache to [default: max_size_mb].')
+def prune(config_path: str, max_size: float) -> None:
+    from .commands.cache import prune as cache_prune
+    cache_prune(config_path, max_size=max_size)
 
 
 if __name__ == '__main__':
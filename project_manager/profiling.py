@@ -0,0 +1,162 @@
+"""
+Record how long the phases of a command take (per environment).
+
+Reports contain the individual timings, aggregates per phase and per
+environment as well as the resource usage of the process and its
+subprocesses.
+"""
+
+import os
+import csv
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+RECORD_FIELDS = ['phase', 'environment', 'wall_time', 'cpu_time', 'bytes']
+
+
+def get_rusage(who):
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(who)
+    return {
+        'user_time': usage.ru_utime,
+        'system_time': usage.ru_stime,
+        'max_rss_kb': usage.ru_maxrss,
+        'blocks_read': usage.ru_inblock,
+        'blocks_written': usage.ru_oublock
+    }
+
+
+class Profiler:
+    def __init__(self, enabled=True, exclusive=True):
+        # CPU time of subprocesses can only be attributed to a phase if
+        # no other subprocesses run concurrently (`exclusive`)
+        self.enabled = enabled
+        self.exclusive = exclusive
+        self.records = []
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name, environment=None):
+        """Time the enclosed block, the yielded record can be annotated
+        with `bytes` and `cpu_time`."""
+        record = {'phase': name, 'environment': environment,
+                  'cpu_time': None, 'bytes': None}
+        if not self.enabled:
+            yield record
+            return
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = time.perf_counter() - start
+            self.records.append(record)
+
+    def children_cpu_time(self):
+        if resource is None:
+            return None
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    def get_phases(self):
+        phases = {}
+        for record in self.records:
+            info = phases.setdefault(record['phase'], {
+                'count': 0, 'wall_time': 0, 'max_wall_time': 0,
+                'cpu_time': None, 'bytes': None})
+            info['count'] += 1
+            info['wall_time'] += record['wall_time']
+            info['max_wall_time'] = max(
+                info['max_wall_time'], record['wall_time'])
+            for key in ('cpu_time', 'bytes'):
+                if record[key] is not None:
+                    info[key] = (info[key] or 0) + record[key]
+        return phases
+
+    def get_environments(self):
+        environments = {}
+        for record in self.records:
+            if record['environment'] is None:
+                continue
+            info = environments.setdefault(record['environment'], {
+                'wall_time': 0, 'phases': {}})
+            info['wall_time'] += record['wall_time']
+            info['phases'][record['phase']] = (
+                info['phases'].get(record['phase'], 0) + record['wall_time'])
+        return environments
+
+    def get_report(self, command):
+        return {
+            'command': command,
+            'wall_time': time.perf_counter() - self.started,
+            'rusage': {
+                'self': get_rusage(resource.RUSAGE_SELF)
+                if resource else None,
+                'children': get_rusage(resource.RUSAGE_CHILDREN)
+                if resource else None
+            },
+            'phases': self.get_phases(),
+            'environments': self.get_environments(),
+            'records': self.records
+        }
+
+    def write(self, command, fname):
+        # CSV files only contain the individual records
+        if os.path.splitext(fname)[1].lower() == '.csv':
+            with open(fname, 'w', newline='') as fd:
+                writer = csv.DictWriter(fd, fieldnames=RECORD_FIELDS)
+                writer.writeheader()
+                writer.writerows(self.records)
+        else:
+            with open(fname, 'w') as fd:
+                json.dump(self.get_report(command), fd, indent=1)
+
+    def print_summary(self, command, top=5):
+        report = self.get_report(command)
+
+        print(f'Timings of {command} ({report["wall_time"]:.2f}s total):')
+        print('Slowest phases:')
+        phases = sorted(
+            report['phases'].items(), key=lambda e: -e[1]['wall_time'])
+        for name, info in phases[:top]:
+            extra = ''
+            if info['cpu_time'] is not None:
+                extra += f', {info["cpu_time"]:.2f}s CPU'
+            if info['bytes'] is not None:
+                extra += f', {info["bytes"] / 2**20:.1f} MB'
+            print(f' - {name}: {info["wall_time"]:.2f}s '
+                  f'({info["count"]}x, max {info["max_wall_time"]:.2f}s'
+                  f'{extra})')
+
+        if len(report['environments']) > 0:
+            print('Slowest environments:')
+            environments = sorted(
+                report['environments'].items(),
+                key=lambda e: -e[1]['wall_time'])
+            for name, info in environments[:top]:
+                print(f' - {name}: {info["wall_time"]:.2f}s')
+
+        usage = report['rusage']['children']
+        if usage is not None:
+            print(f'Subprocesses: {usage["user_time"]:.2f}s user, '
+                  f'{usage["system_time"]:.2f}s system')
+
+    def finish(self, command, timings_path=None, summary=True):
+        if not self.enabled:
+            return
+        if timings_path is not None:
+            self.write(command, timings_path)
+        if summary:
+            self.print_summary(command)
+
+
+DISABLED = Profiler(enabled=False)
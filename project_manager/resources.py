@@ -0,0 +1,153 @@
+"""
+Resource requirements of environments and a scheduler respecting them.
+
+Requirements are either numbers or arithmetic expressions over the
+environment's config, e.g. `cpus: "{n_threads} + 1"`.
+"""
+
+import os
+import ast
+import math
+import operator
+import collections
+
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from tqdm import tqdm
+
+
+DEFAULT_RESOURCES = {'cpus': 1, 'mem_mb': 0, 'gpus': 0}
+
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos
+}
+FUNCTIONS = {'min': min, 'max': max, 'ceil': math.ceil, 'floor': math.floor}
+
+
+def evaluate(expr: str) -> float:
+    # only allow arithmetic
+    def _eval(node):
+        if isinstance(node, ast.Constant) and isinstance(
+            node.value, (int, float)
+        ):
+            return node.value
+        # numbers are parsed as ast.Num before Python 3.8
+        if type(node).__name__ == 'Num' and isinstance(node.n, (int, float)):
+            return node.n
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](
+                _eval(node.left), _eval(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](_eval(node.operand))
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id in FUNCTIONS and not node.keywords):
+            return FUNCTIONS[node.func.id](*[_eval(a) for a in node.args])
+        raise RuntimeError(f'Invalid resource expression: "{expr}"')
+
+    try:
+        return _eval(ast.parse(expr, mode='eval').body)
+    except SyntaxError:
+        raise RuntimeError(f'Invalid resource expression: "{expr}"')
+
+
+def has_expressions(resources: dict) -> bool:
+    return any(isinstance(v, str) for v in resources.values())
+
+
+def get_requirements(resources: dict, cur_config: dict = None) -> dict:
+    requirements = {}
+    for key, default in DEFAULT_RESOURCES.items():
+        value = resources.get(key, default)
+        if isinstance(value, str):
+            value = evaluate(value.format(**(cur_config or {})))
+        if key == 'gpus':
+            # GPUs are assigned as a whole
+            value = int(math.ceil(value))
+        requirements[key] = value
+    return requirements
+
+
+def get_gpu_ids() -> list:
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES', '')
+    return [gpu for gpu in visible.split(',') if gpu != '']
+
+
+def get_default_limits() -> dict:
+    try:
+        mem_mb = (os.sysconf('SC_PAGE_SIZE')
+                  * os.sysconf('SC_PHYS_PAGES')) // 2**20
+    except (ValueError, OSError, AttributeError):
+        mem_mb = math.inf
+
+    return {
+        'cpus': os.cpu_count() or 1,
+        'mem_mb': mem_mb,
+        'gpus': len(get_gpu_ids())
+    }
+
+
+def schedule(tasks, limits: dict, max_jobs: int, submit):
+    """Run `tasks` (name, requirements) while respecting resource limits.
+
+    `submit(name, gpu_ids)` has to start the task and return a future,
+    `gpu_ids` is None if the task does not require GPUs.
+    Yields `(name, result)` for each finished task.
+    """
+    gpu_ids = get_gpu_ids() or [str(i) for i in range(limits['gpus'])]
+    free_gpus = gpu_ids[:limits['gpus']]
+    free = dict(limits)
+
+    # tasks with identical requirements are queued together
+    queues = collections.OrderedDict()
+    for name, requirements in tasks:
+        key = tuple(sorted(requirements.items()))
+        queues.setdefault(key, collections.deque()).append(name)
+
+    running = {}
+    while len(queues) > 0 or len(running) > 0:
+        # start all tasks which fit (first fit)
+        for key in list(queues):
+            requirements = dict(key)
+            queue = queues[key]
+
+            while len(queue) > 0 and len(running) < max_jobs:
+                fits = all(requirements[k] <= free[k] for k in free)
+                if not fits and len(running) > 0:
+                    break
+                if not fits:
+                    # would never fit, so run it on its own
+                    tqdm.write(
+                        f'Warning: "{queue[0]}" requires {requirements}, '
+                        f'which exceeds the limits {limits}')
+
+                name = queue.popleft()
+                # tasks without GPUs inherit CUDA_VISIBLE_DEVICES unchanged
+                gpus = None
+                if requirements['gpus'] > 0:
+                    gpus = free_gpus[:requirements['gpus']]
+                    del free_gpus[:requirements['gpus']]
+                for k in free:
+                    free[k] -= requirements[k]
+
+                running[submit(name, gpus)] = (name, requirements, gpus)
+
+            if len(queue) == 0:
+                del queues[key]
+
+        # wait for tasks to finish
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name, requirements, gpus = running.pop(future)
+            free_gpus.extend(gpus or [])
+            for k in free:
+                free[k] += requirements[k]
+
+            yield name, future.result()
@@ -0,0 +1,249 @@
+"""
+Expand the parameter matrix of a config lazily.
+
+Environments are numbered in `itertools.product` order (with repetitions
+innermost), so any slice of the schedule can be generated without
+enumerating its predecessors.
+"""
+
+import copy
+import operator
+import functools
+
+from .utils import (
+    SECTION_SEPARATOR,
+    PARAMETER_SEPARATOR,
+    NESTED_PARAMETER_SEPARATOR,
+    PARAMETER_ASSIGNMENT,
+    get_by_keylist,
+    assign_to_dict_shared,
+    dict_to_keyset
+)
+
+
+SPECIAL_EXTRA_KEYS = ['repetitions']  # these get handled individually
+
+
+def _config_item(entry, i):
+    if 'paired' in entry:
+        pair = [{'key': c['key'], 'value': c['values'][i]}
+                for c in entry['paired']]
+    else:
+        pair = None
+    return ('config', entry['key'], entry['values'][i], pair)
+
+
+def _extra_item(key, values, i):
+    return ('extra', key, values[i], None)
+
+
+def get_dimensions(config):
+    dimensions = []
+    for entry in config.get('config_parameters', []):
+        # sanity checks
+        for e in entry.get('paired', []):
+            if len(e['values']) != len(entry['values']):
+                raise RuntimeError(
+                    f'Invalid pairing for "{entry["key"]}" & "{e["key"]}"')
+
+        dimensions.append((
+            len(entry['values']),
+            functools.partial(_config_item, entry)))
+
+    for k, vs in config['extra_parameters'].items():
+        if k in SPECIAL_EXTRA_KEYS:
+            continue
+        dimensions.append((len(vs), functools.partial(_extra_item, k, vs)))
+
+    return dimensions
+
+
+def get_spec(dimensions, idx):
+    # decode index (last dimension varies fastest)
+    spec = []
+    for length, item in reversed(dimensions):
+        idx, i = divmod(idx, length)
+        spec.append(item(i))
+    return spec[::-1]
+
+
+def count_environments(config, start=None, stop=None):
+    dimensions = get_dimensions(config)
+    total = functools.reduce(
+        operator.mul, [length for length, _ in dimensions], 1)
+    total *= config['extra_parameters']['repetitions']
+    return len(range(*slice(start, stop).indices(total)))
+
+
+def generate_config(base_config, spec):
+    # untouched parts of the config are shared with `base_config`
+    cur_conf = copy.copy(base_config)
+    owned = {id(cur_conf)}
+
+    for t, k, v, p in spec:
+        if t != 'config':
+            continue
+
+        # set main parameter
+        assign_to_dict_shared(cur_conf, k, v, owned)
+
+        # set potential paired parameters
+        if p is not None:
+            for entry in p:
+                k, v = entry['key'], entry['value']
+                assign_to_dict_shared(cur_conf, k, v, owned)
+
+    return cur_conf
+
+
+def _validate_key(base_config, key, value):
+    keys = key if isinstance(key, list) else [key]
+
+    node = base_config
+    for i, k in enumerate(keys):
+        if isinstance(node, list):
+            # nested lists are not part of the key structure
+            return True
+        if not isinstance(node, dict):
+            raise RuntimeError(
+                f'Invalid key "{format_key(key)}": '
+                f'"{format_key(keys[:i])}" is not a dict.')
+        if k not in node:
+            return False
+        node = node[k]
+
+    # replacing a (sub-)dict must preserve its keys
+    if isinstance(node, dict) or isinstance(value, dict):
+        return (isinstance(node, dict) and isinstance(value, dict)
+                and dict_to_keyset(node) == dict_to_keyset(value))
+    return True
+
+
+def validate_schedule(config, base_config):
+    # assert subset relation (so only valid keys are used)
+    get_dimensions(config)  # checks pairings
+
+    invalid_keys = []
+    for entry in config.get('config_parameters', []):
+        for e in [entry] + entry.get('paired', []):
+            key = format_key(e['key'])
+            if key in invalid_keys:
+                continue
+
+            if not all(_validate_key(base_config, e['key'], v)
+                       for v in e['values']):
+                invalid_keys.append(key)
+
+    if len(invalid_keys) > 0:
+        msg = 'Generated config is invalid.\n'
+
+        msg += 'Only in generated config:\n'
+        for k in invalid_keys:
+            msg += f' > {k}\n'
+
+        raise RuntimeError(msg)
+
+
+def get_parameters(config, cur_conf, extra_info):
+    # values of all swept parameters of an environment
+    parameters = {}
+    for entry in config.get('config_parameters', []):
+        for e in [entry] + entry.get('paired', []):
+            keys = e['key'] if isinstance(e['key'], list) else [e['key']]
+            parameters[format_key(e['key'])] = get_by_keylist(cur_conf, keys)
+    parameters.update(extra_info)
+    return parameters
+
+
+def format_key(key):
+    return (NESTED_PARAMETER_SEPARATOR.join(map(str, key))
+            if isinstance(key, list)
+            else key)
+
+
+def format_value(value):
+    return str(value).replace('/', '_')
+
+
+def get_target_dir(spec, repetition=None):
+    # config parameters come first, each group is sorted by key
+    items = sorted(
+        ((t, format_key(k), v) for t, k, v, p in spec),
+        key=lambda item: item[:2])
+    idx = PARAMETER_SEPARATOR.join(
+        [f'{k}{PARAMETER_ASSIGNMENT}{format_value(v)}'
+         for t, k, v in items])
+    rep_app = (
+        f'{PARAMETER_SEPARATOR}repetition{PARAMETER_ASSIGNMENT}{repetition}'
+        if repetition is not None
+        else '')
+    return f'run{SECTION_SEPARATOR}{idx}{rep_app}'
+
+
+def parse_target_dir(name):
+    idx = name[len(f'run{SECTION_SEPARATOR}'):]
+    return dict(
+        item.split(PARAMETER_ASSIGNMENT, 1)
+        for item in idx.split(PARAMETER_SEPARATOR)
+        if PARAMETER_ASSIGNMENT in item)
+
+
+def get_spec_index(dimensions, idxs):
+    # encode index (inverse of `get_spec`)
+    spec_idx = 0
+    for (length, _), i in zip(dimensions, idxs):
+        spec_idx = spec_idx * length + i
+    return spec_idx
+
+
+def get_target_dirs(config, spec_idx):
+    # names of all repetitions of a parameter combination
+    spec = get_spec(get_dimensions(config), spec_idx)
+    repetition_count = config['extra_parameters']['repetitions']
+    if repetition_count == 1:
+        return [get_target_dir(spec)]
+    return [get_target_dir(spec, rep + 1) for rep in range(repetition_count)]
+
+
+def iter_environments(
+    config, base_config, start=None, stop=None, indices=None
+):
+    """Yield `(target_dir, config, extra_info)` for each environment.
+
+    Instead of a slice, `indices` can select parameter combinations (whose
+    repetitions are all yielded). The schedule has to be checked with
+    `validate_schedule` beforehand.
+    """
+    dimensions = get_dimensions(config)
+    repetition_count = config['extra_parameters']['repetitions']
+
+    if indices is None:
+        start, stop, _ = slice(start, stop).indices(
+            count_environments(config))
+        if start >= stop:
+            return
+
+        first_spec = start // repetition_count
+        last_spec = (stop - 1) // repetition_count
+        indices = range(first_spec, last_spec + 1)
+    else:
+        start, stop = 0, count_environments(config)
+
+    for spec_idx in indices:
+        spec = get_spec(dimensions, spec_idx)
+
+        # create custom config
+        cur_conf = generate_config(base_config, spec)
+
+        # extract extra info
+        extra_info = {format_key(k): v
+                      for t, k, v, p in spec
+                      if t == 'extra'}
+
+        for rep in range(repetition_count):
+            if not start <= spec_idx * repetition_count + rep < stop:
+                continue
+
+            target_dir = get_target_dir(
+                spec, rep + 1 if repetition_count > 1 else None)
+            yield target_dir, cur_conf, extra_info
@@ -0,0 +1,195 @@
+"""
+Combine result files of all environments into a single table.
+
+Result files are parsed by the reader registered for their extension in
+`READERS` (which can be extended), and the resulting rows are written
+using one of the `WRITERS`.
+"""
+
+import os
+import csv
+import json
+import tempfile
+
+
+def _convert(value):
+    if value == '':
+        return None
+    for type_ in (int, float):
+        try:
+            return type_(value)
+        except ValueError:
+            pass
+    return value
+
+
+def read_csv(fname):
+    with open(fname, newline='') as fd:
+        for row in csv.DictReader(fd):
+            yield {k: _convert(v) for k, v in row.items()}
+
+
+def read_json(fname):
+    with open(fname) as fd:
+        data = json.load(fd)
+
+    entries = data if isinstance(data, list) else [data]
+    for entry in entries:
+        yield entry if isinstance(entry, dict) else {'value': entry}
+
+
+def read_npy(fname):
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError(f'Reading "{fname}" requires numpy')
+
+    arr = np.load(fname, allow_pickle=False)
+    if arr.dtype.names is not None:
+        for rec in arr.reshape(-1):
+            yield {name: rec[name].item() for name in arr.dtype.names}
+    elif arr.ndim <= 1:
+        for value in arr.reshape(-1):
+            yield {'value': value.item()}
+    else:
+        for row in arr.reshape(len(arr), -1):
+            yield {f'value_{i}': value.item() for i, value in enumerate(row)}
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+    '.npy': read_npy
+}
+
+
+def get_reader(fname):
+    return READERS.get(os.path.splitext(fname)[1].lower())
+
+
+def _resolve_type(type_names):
+    type_names = type_names - {'NoneType'}
+    if type_names == {'bool'}:
+        return 'bool'
+    if len(type_names) > 0 and type_names <= {'int'}:
+        return 'int'
+    if len(type_names) > 0 and type_names <= {'int', 'float'}:
+        return 'float'
+    return 'str'
+
+
+def _cast(value, type_):
+    if value is None:
+        return None
+    if type_ == 'float':
+        return float(value)
+    if type_ == 'str' and not isinstance(value, str):
+        return json.dumps(value, default=str)
+    return value
+
+
+def _iter_chunks(spool, columns, chunk_size):
+    chunk = []
+    for line in spool:
+        row = json.loads(line)
+        chunk.append({col: _cast(row.get(col), info['type'])
+                      for col, info in columns.items()})
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def write_csv(chunks, fname, columns):
+    with open(fname, 'w', newline='') as fd:
+        writer = csv.DictWriter(fd, fieldnames=list(columns))
+        writer.writeheader()
+        for chunk in chunks:
+            writer.writerows(chunk)
+
+
+def write_parquet(chunks, fname, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Writing parquet files requires pyarrow')
+
+    types = {
+        'bool': pa.bool_(), 'int': pa.int64(),
+        'float': pa.float64(), 'str': pa.string()}
+    schema = pa.schema(
+        [(col, types[info['type']]) for col, info in columns.items()])
+
+    with pq.ParquetWriter(fname, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+
+
+def write_hdf5(chunks, fname, columns):
+    try:
+        import pandas as pd
+    except ImportError:
+        raise RuntimeError('Writing HDF5 files requires pandas and pytables')
+
+    # HDF5 tables have no missing integers/booleans and fixed string sizes
+    dtypes = {}
+    for col, info in columns.items():
+        if info['type'] in ('int', 'bool') and info['nullable']:
+            dtypes[col] = 'float64'
+        else:
+            dtypes[col] = {
+                'bool': 'bool', 'int': 'int64',
+                'float': 'float64', 'str': 'object'}[info['type']]
+    min_itemsize = {col: max(info['max_len'], 1)
+                    for col, info in columns.items()
+                    if info['type'] == 'str'}
+
+    with pd.HDFStore(fname, mode='w') as store:
+        for chunk in chunks:
+            df = pd.DataFrame.from_records(chunk, columns=list(columns))
+            df[list(min_itemsize)] = df[list(min_itemsize)].fillna('')
+            store.append(
+                'results', df.astype(dtypes), format='table',
+                min_itemsize=min_itemsize, index=False)
+
+
+WRITERS = {
+    'csv': ('.csv', write_csv),
+    'parquet': ('.parquet', write_parquet),
+    'hdf5': ('.h5', write_hdf5)
+}
+
+
+def write_table(rows, fname, table_type='csv', chunk_size=10000):
+    """Stream `rows` (dicts) into a single table with typed columns."""
+    _, writer = WRITERS[table_type]
+
+    # rows are spooled to disk while the columns and their types are
+    # determined, so memory usage does not depend on the number of rows
+    columns = {}
+    row_count = 0
+    with tempfile.TemporaryFile('w+') as spool:
+        for row in rows:
+            row_count += 1
+            for col, value in row.items():
+                info = columns.setdefault(col, {
+                    'types': set(), 'count': 0,
+                    'nullable': False, 'max_len': 0})
+                info['count'] += 1
+                info['types'].add(type(value).__name__)
+                if value is None:
+                    info['nullable'] = True
+                else:
+                    info['max_len'] = max(
+                        info['max_len'], len(_cast(value, 'str')))
+            spool.write(json.dumps(row, default=str) + '\n')
+
+        for col, info in columns.items():
+            info['type'] = _resolve_type(info['types'])
+            info['nullable'] |= info['count'] < row_count
+
+        spool.seek(0)
+        writer(_iter_chunks(spool, columns, chunk_size), fname, columns)
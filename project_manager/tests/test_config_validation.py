@@ -1,8 +1,10 @@
+import os
 import copy
 
 import yaml
 
 from ..config_validation import main as validate
+from ..utils import load_env_config
 
 
 def test_minimal_config():
@@ -54,3 +56,32 @@ extra_parameters:
 
     validate(data)
     assert data == orig_data
+
+
+def test_defaults_are_not_shared():
+    minimal = {
+        'project_source': 'foo',
+        'working_dir': 'bar',
+        'base_config': None
+    }
+    data1 = validate(dict(minimal))
+    data1['exec_command'].append('echo foo')
+
+    data2 = validate(dict(minimal))
+    assert data2['exec_command'] == []
+
+
+def test_env_config_memoization(tmp_path):
+    fname = str(tmp_path / 'config.yaml')
+    with open(fname, 'w') as fd:
+        fd.write('foo: 1\n')
+
+    config = load_env_config(fname)
+    assert config == {'foo': 1}
+    assert load_env_config(fname) is config
+
+    # changed files are loaded again
+    with open(fname, 'w') as fd:
+        fd.write('foo: 42\n')
+    os.utime(fname, ns=(0, 0))
+    assert load_env_config(fname) == {'foo': 42}
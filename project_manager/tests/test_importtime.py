@@ -0,0 +1,41 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+
+HEAVY_MODULES = {'sh', 'anyconfig', 'jsonschema', 'tqdm', 'yaml'}
+
+
+def get_imported_modules(statement):
+    """Return the top-level packages imported by `statement`."""
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        env=env, capture_output=True, text=True, check=True)
+
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        name = line.split('|')[-1]
+        modules.add(name.strip().split('.')[0])
+    return modules
+
+
+def test_cli_startup():
+    modules = get_imported_modules('import project_manager.main')
+    assert modules.isdisjoint(HEAVY_MODULES)
+
+
+@pytest.mark.parametrize('command,unneeded', [
+    ('status', {'sh', 'anyconfig', 'jsonschema', 'tqdm'}),
+    ('gather', {'sh', 'anyconfig', 'jsonschema', 'tqdm'}),
+    ('run', {'sh', 'anyconfig', 'jsonschema'}),
+    ('build', {'anyconfig', 'jsonschema'})
+])
+def test_command_imports(command, unneeded):
+    modules = get_imported_modules(
+        f'from project_manager.commands import {command}')
+    assert modules.isdisjoint(unneeded)
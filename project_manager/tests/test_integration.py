@@ -1,7 +1,18 @@
 import os
+import re
+import csv
+import sys
 import glob
+import json
+import shlex
+import socket
 import shutil
+import importlib
+import subprocess
 import itertools
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
 
@@ -9,8 +20,19 @@ import pytest
 from click.testing import CliRunner
 
 from ..main import cli
-from ..commands import build
-from ..utils import SECTION_SEPARATOR, PARAMETER_ASSIGNMENT, PARAMETER_SEPARATOR
+from .. import index, profiling, workers
+from ..commands.build import main as build
+from ..schedule import parse_target_dir
+from ..utils import (
+    SECTION_SEPARATOR,
+    PARAMETER_ASSIGNMENT,
+    PARAMETER_SEPARATOR,
+    read_status,
+    claim_environment,
+    release_environment,
+    get_claim_owner,
+    copy_tree
+)
 
 
 def test_dummy():
@@ -37,7 +59,8 @@ def test_dummy():
         assert result_gather.exit_code == 0
 
         # check individual outputs
-        assert len(os.listdir('tmp/')) == 12 + 1  # |run| + |agg|
+        assert len([e for e in os.listdir('tmp/')
+                    if not e.startswith('.')]) == 12 + 1  # |run| + |agg|
 
         for entry in os.scandir('tmp/'):
             if not entry.name.startswith(f'run{SECTION_SEPARATOR}'):
@@ -97,6 +120,37 @@ def test_dummy():
                 assert fd.read() == 'does not matter'
 
 
+def test_parallel_gather():
+    root = os.path.join(os.getcwd(), 'project_manager', 'tests')
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        shutil.copy(os.path.join(root, 'config.yaml'), 'config.yaml')
+        shutil.copytree(os.path.join(root, 'dummy_project'), 'dummy_project')
+
+        for cmd in ['build', 'run']:
+            result = runner.invoke(cli, [cmd], catch_exceptions=False)
+            assert result.exit_code == 0
+
+        result_gather = runner.invoke(cli, ['gather'], catch_exceptions=False)
+        assert result_gather.exit_code == 0
+
+        # parallel gathering yields the same result
+        result_gather_parallel = runner.invoke(
+            cli, ['gather', '--jobs', '4', '--output', 'tmp_parallel'],
+            catch_exceptions=False)
+        assert result_gather_parallel.exit_code == 0
+        assert result_gather_parallel.output == result_gather.output
+
+        def list_files(path):
+            return sorted(
+                os.path.relpath(fname, path)
+                for fname in glob.glob(f'{path}/**', recursive=True))
+        assert list_files('tmp_parallel') == list_files(
+            'tmp/aggregated_results')
+
+
 def test_key_misspelling():
     runner = CliRunner()
 
@@ -124,6 +178,9 @@ config_parameters:
         with pytest.raises(RuntimeError, match='> misspelled_key'):
             build('config.yaml')
 
+        # nothing was created
+        assert not os.path.exists('tmp')
+
 
 def test_mismatching_key_pairing_name():
     runner = CliRunner()
@@ -156,6 +213,9 @@ config_parameters:
         ):
             build('config.yaml')
 
+        # nothing was created
+        assert not os.path.exists('tmp')
+
 
 def test_mismatching_key_pairing_length():
     runner = CliRunner()
@@ -224,3 +284,1434 @@ config_parameters:
         os.chdir(root_iso)
         result_gather = runner.invoke(cli, ['gather'], catch_exceptions=False)
         assert result_gather.exit_code == 0
+
+
+def test_parallel_run():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        root_iso = os.getcwd()
+
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo {my_key} > results.txt
+    - test {my_key} -ne 3
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3,4]
+            """)
+
+        # run commands
+        os.chdir(root_iso)
+        result_build = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result_build.exit_code == 0
+
+        os.chdir(root_iso)
+        result_run = runner.invoke(
+            cli, ['run', '--jobs', '4'], catch_exceptions=False)
+        assert result_run.exit_code != 0
+        assert '1/4 environments failed' in result_run.output
+        assert 'run.my_key=3 (exit code 1)' in result_run.output
+
+        # every job ran in its own directory
+        for i in range(1, 5):
+            with open(f'tmp/run.my_key={i}/results.txt') as fd:
+                assert fd.read() == f'{i}\n'
+
+
+def test_parallel_build():
+    root = os.path.join(os.getcwd(), 'project_manager', 'tests')
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        root_iso = os.getcwd()
+        shutil.copy(os.path.join(root, 'config.yaml'), 'config.yaml')
+        shutil.copytree(os.path.join(root, 'dummy_project'), 'dummy_project')
+
+        # run commands
+        os.chdir(root_iso)
+        result_build = runner.invoke(
+            cli, ['build', '--jobs', '4'], catch_exceptions=False)
+        assert result_build.exit_code == 0
+
+        # check environments
+        run_dirs = [e for e in os.listdir('tmp/')
+                    if e.startswith(f'run{SECTION_SEPARATOR}')]
+        assert len(run_dirs) == 12
+
+        for entry in run_dirs:
+            with open(os.path.join('tmp', entry, 'my_conf.yaml')) as fd:
+                conf = yaml.full_load(fd)
+            assert f'number={conf["number"]}' in entry
+
+        # existing working directory is rejected
+        os.chdir(root_iso)
+        result_build = runner.invoke(cli, ['build', '--jobs', '4'])
+        assert result_build.exit_code != 0
+        assert 'does already exist' in result_build.output
+
+
+def test_parallel_build_failure(monkeypatch):
+    build_module = importlib.import_module('..commands.build', __package__)
+    setup_environment = build_module.setup_environment
+
+    def failing_setup(target_dir, *args, **kwargs):
+        setup_environment(target_dir, *args, **kwargs)
+        if target_dir.endswith('my_key=2'):
+            raise RuntimeError('setup failed')
+
+    monkeypatch.setattr(build_module, 'setup_environment', failing_setup)
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: project
+working_dir: tmp
+exec_command:
+    - echo "{my_key}"
+base_config: null
+config_parameters:
+    - key: my_key
+      values: [1,2,3,4,5,6]
+            """)
+        os.makedirs('project')
+
+        # the error is raised, finished environments are indexed
+        result = runner.invoke(cli, ['build', '--jobs', '2'])
+        assert isinstance(result.exception, RuntimeError)
+
+        names = [env['name'] for env in index.get_environments('tmp')]
+        assert len(names) > 0
+        assert 'run.my_key=2' not in names
+        assert all(os.path.isdir(os.path.join('tmp', n)) for n in names)
+
+
+def test_git_cache():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        root_iso = os.getcwd()
+
+        git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@test']
+        subprocess.run(git + ['init', '-q', 'project'], check=True)
+        for branch in ['first', 'second']:
+            subprocess.run(
+                git + ['checkout', '-q', '-b', branch], cwd='project',
+                check=True)
+            with open('project/branch.txt', 'w') as fd:
+                fd.write(branch)
+            subprocess.run(git + ['add', '.'], cwd='project', check=True)
+            subprocess.run(
+                git + ['commit', '-q', '-m', branch], cwd='project',
+                check=True)
+        subprocess.run(
+            git + ['clone', '-q', '--bare', 'project', 'remote.git'],
+            check=True)
+
+        with open('config.yaml', 'w') as fd:
+            fd.write(f"""
+project_source: file://{root_iso}/remote.git
+working_dir: tmp
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3]
+extra_parameters:
+    git_branch: [first, second]
+            """)
+
+        # run commands
+        os.chdir(root_iso)
+        result_build = runner.invoke(
+            cli, ['build', '--git-cache'], catch_exceptions=False)
+        assert result_build.exit_code == 0
+
+        # repository was checked out once per branch
+        assert len(os.listdir('tmp/.project_manager/git_cache/checkouts')) == 2
+
+        for entry in os.scandir('tmp/'):
+            if not entry.name.startswith(f'run{SECTION_SEPARATOR}'):
+                continue
+
+            branch = 'first' if 'git_branch=first' in entry.name else 'second'
+            with open(os.path.join(entry.path, 'branch.txt')) as fd:
+                assert fd.read() == branch
+
+            head = subprocess.run(
+                ['git', 'rev-parse', '--abbrev-ref', 'HEAD'], cwd=entry.path,
+                check=True, capture_output=True, text=True)
+            assert head.stdout.strip() == branch
+
+        # environments do not depend on the cache
+        shutil.rmtree('tmp/.project_manager/git_cache')
+        for entry in glob.glob('tmp/run.*'):
+            subprocess.run(
+                ['git', 'fsck', '--full'], cwd=entry, check=True,
+                capture_output=True)
+            subprocess.run(
+                ['git', 'log', '-q'], cwd=entry, check=True,
+                capture_output=True)
+
+
+@pytest.mark.parametrize(
+    'link_mode', ['copy', 'hardlink', 'reflink', 'symlink-readonly'])
+def test_link_modes(link_mode):
+    root = os.path.join(os.getcwd(), 'project_manager', 'tests')
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        root_iso = os.getcwd()
+        shutil.copy(os.path.join(root, 'config.yaml'), 'config.yaml')
+        shutil.copytree(os.path.join(root, 'dummy_project'), 'dummy_project')
+
+        # run commands
+        os.chdir(root_iso)
+        result_build = runner.invoke(
+            cli, ['build', '--link-mode', link_mode], catch_exceptions=False)
+        assert result_build.exit_code == 0
+
+        os.chdir(root_iso)
+        result_run = runner.invoke(cli, ['run'], catch_exceptions=False)
+        assert result_run.exit_code == 0
+
+        # check environments
+        source_stat = os.stat('dummy_project/run.py')
+        for entry in os.scandir('tmp/'):
+            if not entry.name.startswith(f'run{SECTION_SEPARATOR}'):
+                continue
+
+            run_path = os.path.join(entry.path, 'run.py')
+            assert (os.stat(run_path).st_ino == source_stat.st_ino) == (
+                link_mode in ('hardlink', 'symlink-readonly'))
+            assert os.path.islink(run_path) == (
+                link_mode == 'symlink-readonly')
+
+            # generated config and results are private to each run
+            conf_path = os.path.join(entry.path, 'my_conf.yaml')
+            assert not os.path.islink(conf_path)
+            assert os.stat(conf_path).st_nlink == 1
+            assert os.path.isfile(
+                os.path.join(entry.path, 'results', 'data.txt'))
+
+        # project source is untouched
+        with open('dummy_project/my_conf.yaml') as fd:
+            assert yaml.full_load(fd)['message'] == 'this is important'
+
+
+def test_incremental_build():
+    runner = CliRunner()
+
+    def write_config(values, message='hello'):
+        with open('my_conf.yaml', 'w') as fd:
+            fd.write(f"""
+my_key: 0
+message: {message}
+            """)
+
+        with open('config.yaml', 'w') as fd:
+            fd.write(f"""
+project_source: fubar
+working_dir: tmp
+base_config: my_conf.yaml
+
+exec_command:
+    - echo {{message}} > results.txt
+
+config_parameters:
+    - key: my_key
+      values: {values}
+            """)
+
+    def list_runs():
+        return sorted(e for e in os.listdir('tmp')
+                      if e.startswith(f'run{SECTION_SEPARATOR}'))
+
+    with runner.isolated_filesystem():
+        # setup environment
+        root_iso = os.getcwd()
+        os.makedirs('fubar')
+
+        write_config([1, 2])
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+        result = runner.invoke(cli, ['run'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # extend sweep
+        os.chdir(root_iso)
+        write_config([1, 2, 3])
+        result = runner.invoke(
+            cli, ['build', '--incremental'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        assert list_runs() == ['run.my_key=1', 'run.my_key=2', 'run.my_key=3']
+        assert os.path.exists('tmp/run.my_key=1/results.txt')
+        assert not os.path.exists('tmp/run.my_key=3/results.txt')
+
+        # shrink sweep
+        write_config([2, 3])
+        result = runner.invoke(
+            cli, ['build', '--incremental', '--prune'],
+            catch_exceptions=False)
+        assert result.exit_code == 0
+
+        assert list_runs() == ['run.my_key=2', 'run.my_key=3']
+        assert os.path.exists('tmp/run.my_key=2/results.txt')
+
+        # changed configs are recreated
+        write_config([2, 3], message='bye')
+        result = runner.invoke(
+            cli, ['build', '--incremental'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        assert list_runs() == ['run.my_key=2', 'run.my_key=3']
+        assert not os.path.exists('tmp/run.my_key=2/results.txt')
+        with open('tmp/run.my_key=2/my_conf.yaml') as fd:
+            assert yaml.full_load(fd) == {'my_key': 2, 'message': 'bye'}
+
+
+def test_resumable_run():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo {my_key} >> results.txt
+    - test ! -f ../fail_{my_key}
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3]
+            """)
+
+        def read_results():
+            results = {}
+            for i in range(1, 4):
+                with open(f'tmp/run.my_key={i}/results.txt') as fd:
+                    results[i] = fd.read().split()
+            return results
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # first run with a failure
+        open('tmp/fail_2', 'w').close()
+
+        result = runner.invoke(cli, ['run'], catch_exceptions=False)
+        assert result.exit_code != 0
+        assert read_results() == {1: ['1'], 2: ['2'], 3: ['3']}
+
+        status = read_status('tmp/run.my_key=2')
+        assert status['status'] == 'failed'
+        assert status['exit_code'] == 1
+        assert status['commands'] == [
+            'echo 2 >> results.txt', 'test ! -f ../fail_2']
+        assert read_status('tmp/run.my_key=1')['status'] == 'success'
+
+        # only rerun failed environment
+        os.remove('tmp/fail_2')
+
+        result = runner.invoke(
+            cli, ['run', '--only-failed'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert read_results() == {1: ['1'], 2: ['2', '2'], 3: ['3']}
+
+        # nothing left to do
+        result = runner.invoke(
+            cli, ['run', '--resume'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert read_results() == {1: ['1'], 2: ['2', '2'], 3: ['3']}
+
+        # rerun everything
+        result = runner.invoke(
+            cli, ['run', '--force'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert read_results() == {
+            1: ['1', '1'], 2: ['2', '2', '2'], 3: ['3', '3']}
+
+
+def test_status_index():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo {my_key} > results.txt
+    - test {my_key} -ne 2
+
+result_files:
+    - results.txt
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3]
+            """)
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        envs = index.get_environments('tmp')
+        assert [env['name'] for env in envs] == [
+            f'run.my_key={i}' for i in range(1, 4)]
+        assert envs[0]['parameters'] == {'my_key': 1}
+        assert all(env['status'] == 'pending' for env in envs)
+
+        result = runner.invoke(cli, ['status'], catch_exceptions=False)
+        assert result.output == 'pending: 3\ntotal: 3\n'
+
+        # run updates the index
+        result = runner.invoke(cli, ['run'], catch_exceptions=False)
+        assert result.exit_code != 0
+
+        result = runner.invoke(cli, ['status'], catch_exceptions=False)
+        assert result.output == 'failed: 1\nsuccess: 2\ntotal: 3\n'
+
+        result = runner.invoke(
+            cli, ['status', '--list', '--status', 'failed'],
+            catch_exceptions=False)
+        assert result.output == (
+            'run.my_key=2: failed (exit code 1)\n')
+
+        # environments removed from disk are skipped
+        shutil.rmtree('tmp/run.my_key=1')
+        result = runner.invoke(cli, ['run'], catch_exceptions=False)
+        assert (
+            'Skipping 1 environments which do not exist anymore:\n'
+            ' - run.my_key=1\n') in result.output
+        assert 'run.my_key=3 > test 3 -ne 2' in result.output
+        assert '1/2 environments failed:' in result.output
+
+        result = runner.invoke(cli, ['status'], catch_exceptions=False)
+        assert result.output == (
+            'failed: 1\nmissing: 1\nsuccess: 1\ntotal: 3\n')
+
+        result = runner.invoke(
+            cli, ['status', '--list', '--status', 'missing'],
+            catch_exceptions=False)
+        assert result.output == 'run.my_key=1: missing\n'
+
+        for args in [[], ['--format', 'table']]:
+            result = runner.invoke(
+                cli, ['gather', *args], catch_exceptions=False)
+            assert result.exit_code == 0
+            assert (
+                'Skipping 1 environments which do not exist anymore:\n'
+                ' - run.my_key=1\n') in result.output
+
+        assert sorted(os.listdir('tmp/aggregated_results')) == [
+            'results.csv']
+
+
+def test_incremental_gather():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo {my_key} > results.txt
+
+result_files:
+    - results.txt
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3]
+            """)
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # only some environments finished
+        subprocess.run(
+            'echo 1 > results.txt', shell=True, cwd='tmp/run.my_key=1',
+            check=True)
+
+        result = runner.invoke(
+            cli, ['gather', '--incremental'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert ' > results.txt\n' in result.output
+        assert ' > results.txt (missing)' in result.output
+        assert sorted(os.listdir('tmp/aggregated_results')) == [
+            '.project_manager_gather.json', 'results.my_key=1.txt']
+
+        # unchanged files are not copied again
+        result = runner.invoke(
+            cli, ['gather', '--incremental', '--hash'],
+            catch_exceptions=False)
+        assert result.exit_code == 0
+        assert ' > results.txt\n' not in result.output
+
+        # new and modified files are copied
+        result = runner.invoke(cli, ['run'], catch_exceptions=False)
+        assert result.exit_code == 0
+        with open('tmp/run.my_key=1/results.txt', 'w') as fd:
+            fd.write('updated')
+
+        result = runner.invoke(
+            cli, ['gather', '--incremental'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert result.output.count(' > results.txt\n') == 3
+        with open('tmp/aggregated_results/results.my_key=1.txt') as fd:
+            assert fd.read() == 'updated'
+
+        # results of removed environments are removed
+        shutil.rmtree('tmp/run.my_key=2')
+        index.remove_environments('tmp', ['run.my_key=2'])
+
+        result = runner.invoke(
+            cli, ['gather', '--incremental'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert sorted(os.listdir('tmp/aggregated_results')) == [
+            '.project_manager_gather.json',
+            'results.my_key=1.txt', 'results.my_key=3.txt']
+
+        # hashes are kept for unchanged files
+        def touch_and_gather():
+            os.utime('tmp/run.my_key=3/results.txt')
+            result = runner.invoke(
+                cli, ['gather', '--incremental', '--hash'],
+                catch_exceptions=False)
+            assert result.exit_code == 0
+            return result
+
+        touch_and_gather()
+        result = runner.invoke(
+            cli, ['gather', '--incremental', '--hash'],
+            catch_exceptions=False)
+        assert ' > results.txt\n' not in result.output
+        result = touch_and_gather()
+        assert ' > results.txt\n' not in result.output
+
+        # plain gathers do not write a manifest
+        result = runner.invoke(cli, ['gather'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert sorted(os.listdir('tmp/aggregated_results')) == [
+            'results.my_key=1.txt', 'results.my_key=3.txt']
+
+        # links to removed environments are removed as well
+        args = ['gather', '--incremental', '--link', 'symlink']
+        result = runner.invoke(cli, args, catch_exceptions=False)
+        assert result.exit_code == 0
+        assert os.path.islink('tmp/aggregated_results/results.my_key=3.txt')
+
+        shutil.rmtree('tmp/run.my_key=3')
+        index.remove_environments('tmp', ['run.my_key=3'])
+
+        result = runner.invoke(cli, args, catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'Removing "results.my_key=3.txt"' in result.output
+        assert sorted(os.listdir('tmp/aggregated_results')) == [
+            '.project_manager_gather.json', 'results.my_key=1.txt']
+
+
+def test_gather_table():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('my_conf.yaml', 'w') as fd:
+            fd.write("""
+rate: 0.5
+model:
+    name: x
+            """)
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+base_config: my_conf.yaml
+
+exec_command:
+    - "printf 'step,loss\\\\n1,{rate}\\\\n2,0.1\\\\n' > loss.csv"
+    - "echo '{{\\"score\\": 42}}' > score.json"
+    - echo ignored > notes.txt
+
+result_files:
+    - loss.csv
+    - score.json
+    - notes.txt
+
+config_parameters:
+    - key: rate
+      values: [1, 2]
+      paired:
+          - key: [model, name]
+            values: [a, b]
+extra_parameters:
+    repetitions: 2
+            """)
+
+        for cmd in ['build', 'run']:
+            result = runner.invoke(cli, [cmd], catch_exceptions=False)
+            assert result.exit_code == 0
+
+        result = runner.invoke(
+            cli, ['gather', '--format', 'table'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert ' > notes.txt (no reader, skipped)' in result.output
+
+        assert os.listdir('tmp/aggregated_results') == ['results.csv']
+        with open('tmp/aggregated_results/results.csv') as fd:
+            rows = list(csv.DictReader(fd))
+
+        assert list(rows[0].keys()) == [
+            'rate', 'model+name', 'repetition', 'result_file',
+            'step', 'loss', 'score']
+        assert len(rows) == 2 * 2 * 3
+        assert rows[:3] == [
+            {'rate': '1', 'model+name': 'a', 'repetition': '1',
+             'result_file': 'loss.csv', 'step': '1', 'loss': '1.0',
+             'score': ''},
+            {'rate': '1', 'model+name': 'a', 'repetition': '1',
+             'result_file': 'loss.csv', 'step': '2', 'loss': '0.1',
+             'score': ''},
+            {'rate': '1', 'model+name': 'a', 'repetition': '1',
+             'result_file': 'score.json', 'step': '', 'loss': '',
+             'score': '42'},
+        ]
+
+
+@pytest.mark.parametrize('link', ['copy', 'hardlink', 'symlink'])
+def test_gather_links(link):
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - mkdir -p results && echo {my_key} > results/data.txt
+
+result_files:
+    - results
+
+config_parameters:
+    - key: my_key
+      values: [1,2]
+            """)
+
+        for cmd in [['build'], ['run'], ['gather', '--link', link]]:
+            result = runner.invoke(cli, cmd, catch_exceptions=False)
+            assert result.exit_code == 0
+
+        for i in range(1, 3):
+            source = f'tmp/run.my_key={i}/results/data.txt'
+            target = f'tmp/aggregated_results/results/data.my_key={i}.txt'
+
+            with open(target) as fd:
+                assert fd.read() == f'{i}\n'
+            assert os.path.islink(target) == (link == 'symlink')
+            assert os.path.samefile(source, target) == (link != 'copy')
+
+
+def test_slurm_executor(monkeypatch):
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        root_iso = os.getcwd()
+
+        # fake scheduler
+        os.makedirs('bin')
+        with open('bin/sbatch', 'w') as fd:
+            fd.write("""#!/bin/sh
+echo "$@" > sbatch_args.txt
+cp "$2" submitted.sh
+echo "Submitted batch job 42"
+""")
+        with open('bin/squeue', 'w') as fd:
+            fd.write("""#!/bin/sh
+test -f job_active && echo 42
+exit 0
+""")
+        for fname in ['bin/sbatch', 'bin/squeue']:
+            os.chmod(fname, 0o755)
+        monkeypatch.setenv(
+            'PATH', f'{root_iso}/bin{os.pathsep}{os.environ["PATH"]}')
+
+        # setup environment
+        os.makedirs('fubar')
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo {my_key} > results.txt
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3]
+            """)
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # run options are passed on to the array tasks
+        result = runner.invoke(
+            cli, [
+                'run', '--executor', 'slurm', '--dry', '--resume',
+                '--jobs', '2', '--max-cpus', '4', '--max-mem', '100',
+                '--max-gpus', '0', '--worker-tasks', '5', '--no-cache'],
+            catch_exceptions=False)
+        assert result.exit_code == 0
+        task_cmd = shlex.split(result.output.strip().splitlines()[-1])
+        for args in [
+            ['--resume'], ['--jobs', '2'], ['--max-cpus', '4.0'],
+            ['--max-mem', '100.0'], ['--max-gpus', '0'],
+            ['--worker-tasks', '5'], ['--no-cache']
+        ]:
+            idx = task_cmd.index(args[0])
+            assert task_cmd[idx:idx + len(args)] == args
+
+        # submit
+        open('job_active', 'w').close()
+        result = runner.invoke(
+            cli, [
+                'run', '--executor', 'slurm', '--batch-size', '2',
+                '--scheduler-args', '--time=10'],
+            catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'Submitted 3 environments as job 42' in result.output
+
+        with open('sbatch_args.txt') as fd:
+            assert fd.read().startswith('--time=10 ')
+        with open('submitted.sh') as fd:
+            script = fd.read()
+        assert '#SBATCH --array=0-1' in script
+        assert '--task-index $SLURM_ARRAY_TASK_ID' in script
+
+        # active jobs are not submitted again
+        result = runner.invoke(
+            cli, ['run', '--executor', 'slurm'], catch_exceptions=False)
+        assert 'No environments to submit.' in result.output
+
+        result = runner.invoke(cli, ['status'], catch_exceptions=False)
+        assert 'job 42 (slurm, 3 environments): active' in result.output
+
+        # execute array tasks
+        task_cmd = shlex.split(script.splitlines()[-1])
+        assert task_cmd[-2:] == ['--task-index', '$SLURM_ARRAY_TASK_ID']
+        for task_index in ['0', '1']:
+            result = runner.invoke(
+                cli, task_cmd[3:-1] + [task_index], catch_exceptions=False)
+            assert result.exit_code == 0
+
+        for i in range(1, 4):
+            with open(f'tmp/run.my_key={i}/results.txt') as fd:
+                assert fd.read() == f'{i}\n'
+
+        # finished jobs do not block anything, but all is done
+        os.remove('job_active')
+        result = runner.invoke(cli, ['status'], catch_exceptions=False)
+        assert 'job 42 (slurm, 3 environments): finished' in result.output
+
+        result = runner.invoke(
+            cli, ['run', '--executor', 'slurm', '--resume'],
+            catch_exceptions=False)
+        assert 'No environments to submit.' in result.output
+
+        # without --resume, completed environments are run again
+        result = runner.invoke(
+            cli, [
+                'run', '--executor', 'slurm',
+                '--scheduler-args', '--time=10'],
+            catch_exceptions=False)
+        assert 'Submitted 3 environments as job 42' in result.output
+
+        with open('submitted.sh') as fd:
+            task_cmd = shlex.split(fd.read().splitlines()[-1])
+        assert '--resume' not in task_cmd
+        result = runner.invoke(
+            cli, task_cmd[3:-1] + ['0'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'run.my_key=1 > echo 1 > results.txt' in result.output
+
+
+def test_sharded_run():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo {my_key} >> results.txt
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3,4,5,6,7,8]
+            """)
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # shards are disjoint and complete
+        shard_runs = []
+        for shard in ['1/3', '2/3', '3/3']:
+            result = runner.invoke(
+                cli, ['run', '--shard', shard], catch_exceptions=False)
+            assert result.exit_code == 0
+
+            shard_runs.append({
+                e for e in os.listdir('tmp')
+                if os.path.exists(os.path.join('tmp', e, 'results.txt'))
+            } - set().union(*shard_runs))
+        assert sum(len(runs) for runs in shard_runs) == 8
+
+        result = runner.invoke(cli, ['run', '--shard', '4/3'])
+        assert result.exit_code != 0
+
+
+def test_claimed_run():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo {my_key} >> results.txt && sleep 0.1
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3,4,5,6,7,8,9,10]
+            """)
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # several workers drain the same working directory
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}
+        workers = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'project_manager',
+                 'run', '--claim', '--jobs', '2'],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for _ in range(4)]
+        for worker in workers:
+            assert worker.wait() == 0
+
+        for i in range(1, 11):
+            env_path = f'tmp/run.my_key={i}'
+            with open(os.path.join(env_path, 'results.txt')) as fd:
+                assert fd.read() == f'{i}\n'
+            assert read_status(env_path)['status'] == 'success'
+            assert not os.path.exists(
+                os.path.join(env_path, '.project_manager_claim'))
+
+        # workers joining later skip finished environments
+        result = runner.invoke(
+            cli, ['run', '--claim'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        for i in range(1, 11):
+            with open(f'tmp/run.my_key={i}/results.txt') as fd:
+                assert fd.read() == f'{i}\n'
+
+
+def test_claim_takeover(tmp_path):
+    claim_path = tmp_path / '.project_manager_claim'
+    host = socket.gethostname()
+
+    # pid of a finished process
+    proc = subprocess.Popen([sys.executable, '-c', ''])
+    proc.wait()
+    dead_owner = f'{host}:{proc.pid}'
+
+    # exactly one of several concurrent workers takes over a stale claim
+    for _ in range(20):
+        claim_path.write_text(dead_owner)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            claimed = list(executor.map(
+                lambda _: claim_environment(str(tmp_path)), range(8)))
+        assert claimed.count(True) == 1
+        assert claim_path.read_text() == get_claim_owner()
+
+    # claims of live processes are respected and never released by others
+    claim_path.write_text(f'{host}:{os.getppid()}')
+    assert not claim_environment(str(tmp_path))
+    release_environment(str(tmp_path))
+    assert claim_path.exists()
+
+    claim_path.unlink()
+    assert claim_environment(str(tmp_path))
+    release_environment(str(tmp_path))
+    assert not claim_path.exists()
+
+
+def test_resource_limits():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo start {my_key} >> ../log.txt && sleep 0.2
+    - echo end {my_key} >> ../log.txt
+
+resources:
+    cpus: "{my_key}"
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3]
+    - key: other_key
+      values: [a,b]
+            """)
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        result = runner.invoke(
+            cli, ['run', '--jobs', '4', '--max-cpus', '3'],
+            catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # concurrently running environments never exceed the limit
+        usage = max_usage = 0
+        with open('tmp/log.txt') as fd:
+            for line in fd:
+                event, cpus = line.split()
+                usage += int(cpus) if event == 'start' else -int(cpus)
+                max_usage = max(max_usage, usage)
+        assert max_usage == 3
+
+
+@pytest.mark.parametrize('visible', [None, '0,1'])
+def test_gpus_inherited(monkeypatch, visible):
+    if visible is None:
+        monkeypatch.delenv('CUDA_VISIBLE_DEVICES', raising=False)
+    else:
+        monkeypatch.setenv('CUDA_VISIBLE_DEVICES', visible)
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo "${{CUDA_VISIBLE_DEVICES-unset}}" > gpus.txt
+
+config_parameters:
+    - key: my_key
+      values: [1,2]
+            """)
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+        result = runner.invoke(
+            cli, ['run', '--jobs', '2'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # environments without GPU requirements see all GPUs
+        for i in [1, 2]:
+            with open(f'tmp/run.my_key={i}/gpus.txt') as fd:
+                assert fd.read() == f'{visible or "unset"}\n'
+
+
+def test_run_logs():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo out {my_key} && echo err {my_key} >&2
+    - cmd: test -f flag || (touch flag && false)
+      retries: 1
+      retry_delay: 0
+    - cmd: test {my_key} -ne 2 || sleep 10
+      timeout: 0.5
+
+config_parameters:
+    - key: my_key
+      values: [1,2]
+            """)
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        result = runner.invoke(
+            cli, ['run', '--jobs', '2'], catch_exceptions=False)
+        assert result.exit_code != 0
+        assert 'run.my_key=1 > retrying in 0s (attempt 2/2)' in result.output
+        assert 'run.my_key=2 (exit code -9)' in result.output
+
+        # output of each environment is logged separately
+        with open('tmp/run.my_key=1/.project_manager_run.log') as fd:
+            assert fd.read() == (
+                '$ echo out 1 && echo err 1 >&2\nout 1\nerr 1\n'
+                '$ test -f flag || (touch flag && false)\n'
+                '$ test -f flag || (touch flag && false)\n'
+                '$ test 1 -ne 2 || sleep 10\n')
+        with open('tmp/run.my_key=2/.project_manager_run.log') as fd:
+            assert fd.read().endswith('Timed out after 0.5s\n')
+
+        assert read_status('tmp/run.my_key=1')['status'] == 'success'
+        assert read_status('tmp/run.my_key=2')['status'] == 'failed'
+
+
+def test_python_entry():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+        with open('fubar/entry.py', 'w') as fd:
+            fd.write("""
+import os
+
+# keep track of imports
+with open('../imports.txt', 'a') as fd:
+    fd.write(f'{os.getpid()}\\n')
+
+
+def main(config):
+    print('value', config['my_key'])
+    with open('results.txt', 'w') as fd:
+        fd.write(str(config['my_key'] ** 2))
+    if config['my_key'] == 6:
+        raise ValueError('invalid value')
+            """)
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+python_entry: entry:main
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3,4,5,6]
+            """)
+
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        result = runner.invoke(
+            cli, ['run', '--worker-tasks', '3'], catch_exceptions=False)
+        assert result.exit_code != 0
+        assert '1/6 environments failed' in result.output
+        assert 'run.my_key=6 (exit code 1)' in result.output
+
+        for i in range(1, 7):
+            env_path = f'tmp/run.my_key={i}'
+            with open(os.path.join(env_path, 'results.txt')) as fd:
+                assert fd.read() == str(i ** 2)
+            with open(os.path.join(env_path, '.project_manager_run.log')) as fd:
+                log = fd.read()
+            assert log.startswith(f'$ entry:main\nvalue {i}\n')
+
+        assert 'ValueError: invalid value' in log
+        assert read_status('tmp/run.my_key=5')['status'] == 'success'
+
+        # module was imported once per worker, workers were recycled
+        with open('tmp/imports.txt') as fd:
+            pids = fd.read().split()
+        assert len(pids) == len(set(pids)) == 2
+
+
+def test_entry_gpus(tmp_path, monkeypatch):
+    monkeypatch.delenv('CUDA_VISIBLE_DEVICES', raising=False)
+    with open(tmp_path / 'gpu_entry.py', 'w') as fd:
+        fd.write("""
+import os
+
+
+def main(config):
+    with open(config['output'], 'w') as fd:
+        fd.write(os.environ.get('CUDA_VISIBLE_DEVICES', 'unset'))
+        """)
+
+    # a reused worker does not pass on the GPUs of previous environments
+    log_path = str(tmp_path / 'run.log')
+    for gpu_ids, expected in [(['1'], '1'), (None, 'unset')]:
+        output = str(tmp_path / 'gpus.txt')
+        assert workers.call_entry(
+            'gpu_entry:main', str(tmp_path), {'output': output}, log_path,
+            gpu_ids) == 0
+        with open(output) as fd:
+            assert fd.read() == expected
+        assert 'CUDA_VISIBLE_DEVICES' not in os.environ
+
+
+@pytest.mark.parametrize('method', ['random', 'lhs'])
+def test_search(method):
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write(f"""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo $(( ({{x}} - 3) * ({{x}} - 3) )) > loss.txt
+
+result_files:
+    - loss.txt
+
+config_parameters:
+    - key: x
+      values: [0,1,2,3,4,5,6,7,8,9]
+    - key: y
+      values: [a,b]
+
+search:
+    method: {method}
+    objective:
+        file: loss.txt
+    samples: 4
+    rounds: 3
+            """)
+
+        result = runner.invoke(
+            cli, ['search', '--jobs', '2'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'Round 3/3: 4 parameter combinations' in result.output
+        assert 'Best 5 of 12 parameter combinations:' in result.output
+
+        # environments are named like those of `build`
+        names = [e for e in os.listdir('tmp') if e.startswith('run.')]
+        assert len(names) == 12
+        for name in names:
+            assert re.fullmatch(r'run\.x=\d,y=[ab]', name)
+
+        result = runner.invoke(cli, ['gather'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert len(os.listdir('tmp/aggregated_results')) == 12
+
+
+def test_search_halving():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo loss > log.csv
+    - echo $(( ({x} - 3) * ({x} - 3) * 100 / {epochs} )) >> log.csv
+
+config_parameters:
+    - key: x
+      values: [0,1,2,3,4,5,6,7,8,9]
+    - key: epochs
+      values: [1,2,4]
+
+search:
+    method: halving
+    budget: epochs
+    eta: 2
+    objective:
+        file: log.csv
+        key: loss
+    samples: 8
+            """)
+
+        result = runner.invoke(cli, ['search'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # every rung only continues the best half
+        counts = collections.Counter(
+            parse_target_dir(e)['epochs']
+            for e in os.listdir('tmp') if e.startswith('run.'))
+        assert counts == {'1': 8, '2': 4, '4': 2}
+        assert 'Best 2 of 2 parameter combinations:' in result.output
+
+
+def test_result_cache():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+
+        config = """
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo {my_key} >> ../../executions.txt
+    - mkdir -p out && echo {my_key} > out/results.txt
+
+result_files:
+    - out
+
+cache:
+    path: store
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3]
+        """
+        with open('config.yaml', 'w') as fd:
+            fd.write(config)
+
+        def build_and_run():
+            shutil.rmtree('tmp', ignore_errors=True)
+            result = runner.invoke(cli, ['build'], catch_exceptions=False)
+            assert result.exit_code == 0
+            result = runner.invoke(cli, ['run'], catch_exceptions=False)
+            assert result.exit_code == 0
+            return result
+
+        def count_executions():
+            with open('executions.txt') as fd:
+                return len(fd.read().split())
+
+        build_and_run()
+        assert count_executions() == 3
+
+        # identical environments are restored from the cache
+        result = build_and_run()
+        assert count_executions() == 3
+        assert 'run.my_key=2 > restored results from cache' in result.output
+        for i in range(1, 4):
+            env_path = f'tmp/run.my_key={i}'
+            with open(os.path.join(env_path, 'out/results.txt')) as fd:
+                assert fd.read() == f'{i}\n'
+            assert read_status(env_path)['cached']
+
+        result = runner.invoke(
+            cli, ['cache', 'stats'], catch_exceptions=False)
+        assert 'entries: 3\n' in result.output
+        assert 'hits: 3\n' in result.output
+
+        # changed sources invalidate the cache
+        with open('fubar/model.py', 'w') as fd:
+            fd.write('# new version')
+        build_and_run()
+        assert count_executions() == 6
+
+        # results are stored under the source environments were built from
+        shutil.rmtree('tmp')
+        with open('fubar/model.py', 'w') as fd:
+            fd.write('# newer version')
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+        with open('fubar/model.py', 'w') as fd:
+            fd.write('# newest version')
+        result = runner.invoke(cli, ['run'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert count_executions() == 9
+
+        build_and_run()
+        assert count_executions() == 12
+
+        # evict least recently used results
+        result = runner.invoke(
+            cli, ['cache', 'prune', '--max-size', '0'],
+            catch_exceptions=False)
+        assert 'Evicted 12 entries.' in result.output
+        result = runner.invoke(
+            cli, ['cache', 'stats'], catch_exceptions=False)
+        assert 'entries: 0\n' in result.output
+
+
+def test_result_cache_git_branches():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@test']
+        subprocess.run(git + ['init', '-q', 'project'], check=True)
+        for branch in ['first', 'second']:
+            subprocess.run(
+                git + ['checkout', '-q', '-b', branch], cwd='project',
+                check=True)
+            with open('project/branch.txt', 'w') as fd:
+                fd.write(branch)
+            subprocess.run(git + ['add', '.'], cwd='project', check=True)
+            subprocess.run(
+                git + ['commit', '-q', '-m', branch], cwd='project',
+                check=True)
+
+        with open('config.yaml', 'w') as fd:
+            fd.write("""
+project_source: project
+working_dir: tmp
+
+exec_command:
+    - cp branch.txt result.txt
+
+result_files:
+    - result.txt
+
+cache:
+    path: store
+
+config_parameters:
+    - key: my_key
+      values: [1]
+extra_parameters:
+    git_branch: [first, second]
+            """)
+
+        # run commands
+        result = runner.invoke(cli, ['build'], catch_exceptions=False)
+        assert result.exit_code == 0
+        result = runner.invoke(cli, ['run'], catch_exceptions=False)
+        assert result.exit_code == 0
+
+        # branches with identical configs do not share results
+        assert 'restored results from cache' not in result.output
+        for entry in glob.glob('tmp/run.*'):
+            branch = 'first' if 'git_branch=first' in entry else 'second'
+            with open(os.path.join(entry, 'result.txt')) as fd:
+                assert fd.read() == branch
+
+
+def test_timings():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        # setup environment
+        os.makedirs('fubar')
+        with open('fubar/model.py', 'w') as fd:
+            fd.write('x' * 1000)
+
+        config = """
+project_source: fubar
+working_dir: tmp
+
+exec_command:
+    - echo {my_key} > result.txt
+
+result_files:
+    - result.txt
+
+config_parameters:
+    - key: my_key
+      values: [1,2,3]
+        """
+        with open('config.yaml', 'w') as fd:
+            fd.write(config)
+
+        # run commands
+        for command in ['build', 'run', 'gather']:
+            result = runner.invoke(
+                cli, [command, '--timings-json', f'{command}.json'],
+                catch_exceptions=False)
+            assert result.exit_code == 0
+            assert f'Timings of {command}' not in result.output
+
+        # check reports
+        with open('build.json') as fd:
+            report = json.load(fd)
+        assert report['command'] == 'build'
+        assert report['phases']['copy source']['count'] == 3
+        assert report['phases']['copy source']['bytes'] >= 3 * 1000
+        assert set(report['environments']) == {
+            f'run.my_key={i}' for i in range(1, 4)}
+
+        with open('run.json') as fd:
+            report = json.load(fd)
+        assert report['phases']['command']['count'] == 3
+        assert report['phases']['command']['cpu_time'] is not None
+        assert report['rusage']['children']['user_time'] >= 0
+
+        with open('gather.json') as fd:
+            report = json.load(fd)
+        assert report['phases']['copy']['bytes'] == 3 * 2
+
+        # only print summary
+        result = runner.invoke(
+            cli, ['run', '--force', '--profile'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'Timings of run' in result.output
+        assert 'Slowest phases:' in result.output
+        assert 'Slowest environments:' in result.output
+
+        # records can be stored as CSV
+        result = runner.invoke(
+            cli, ['run', '--force', '--timings-json', 'run.csv'],
+            catch_exceptions=False)
+        assert result.exit_code == 0
+        with open('run.csv') as fd:
+            rows = list(csv.DictReader(fd))
+        assert list(rows[0]) == profiling.RECORD_FIELDS
+        assert sum(row['phase'] == 'command' for row in rows) == 3
+
+        # links are not counted as copied bytes
+        for link_mode, size in [('copy', 1000), ('reflink', 0)]:
+            assert copy_tree(
+                'fubar', f'copy_{link_mode}', link_mode=link_mode,
+                count_bytes=True) == size
@@ -0,0 +1,70 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ..resources import evaluate, get_requirements, schedule
+
+
+def test_evaluate():
+    assert evaluate('2 * 3 + 1') == 7
+    assert evaluate('max(1, 4 / 2)') == 2
+    assert evaluate('ceil(2.5)') == 3
+
+    for expr in ['__import__("os")', 'a + 1', '1 +']:
+        with pytest.raises(RuntimeError, match='Invalid resource expression'):
+            evaluate(expr)
+
+
+def test_requirements():
+    assert get_requirements({}) == {'cpus': 1, 'mem_mb': 0, 'gpus': 0}
+    assert get_requirements(
+        {'cpus': '{n} * 2', 'mem_mb': 512}, {'n': 3}
+    ) == {'cpus': 6, 'mem_mb': 512, 'gpus': 0}
+
+    # GPU counts are rounded up
+    assert get_requirements({'gpus': '{n} / 2'}, {'n': 3})['gpus'] == 2
+    assert isinstance(
+        get_requirements({'gpus': '{n} / 2'}, {'n': 2})['gpus'], int)
+
+
+def test_schedule_gpus():
+    lock = threading.Lock()
+    used_gpus = set()
+    assigned = {}
+
+    def task(name, gpu_ids):
+        with lock:
+            assert used_gpus.isdisjoint(gpu_ids)
+            used_gpus.update(gpu_ids)
+        assigned[name] = gpu_ids
+        with lock:
+            used_gpus.difference_update(gpu_ids)
+        return name
+
+    tasks = [
+        (f't{i}', {'cpus': 1, 'mem_mb': 0, 'gpus': i % 2 + 1})
+        for i in range(6)]
+    limits = {'cpus': 4, 'mem_mb': 0, 'gpus': 2}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(schedule(
+            tasks, limits, 4,
+            lambda name, gpu_ids: executor.submit(task, name, gpu_ids)))
+
+    assert sorted(name for name, _ in results) == sorted(n for n, _ in tasks)
+    for name, requirements in tasks:
+        assert len(assigned[name]) == requirements['gpus']
+
+
+def test_schedule_without_gpus():
+    tasks = [(f't{i}', {'cpus': 1, 'mem_mb': 0, 'gpus': 0}) for i in range(3)]
+    limits = {'cpus': 4, 'mem_mb': 0, 'gpus': 2}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(schedule(
+            tasks, limits, 2,
+            lambda name, gpu_ids: executor.submit(lambda: gpu_ids)))
+
+    assert [gpu_ids for _, gpu_ids in results] == [None] * 3
@@ -0,0 +1,174 @@
+import yaml
+
+import pytest
+
+from click.testing import CliRunner
+
+from ..main import cli
+from ..config_validation import main as validate
+from ..schedule import (
+    count_environments,
+    validate_schedule,
+    iter_environments,
+    get_dimensions,
+    get_spec_index,
+    get_target_dirs
+)
+
+
+CONFIG = """
+project_source: fubar
+working_dir: tmp
+base_config: my_conf.yaml
+config_parameters:
+    - key: message
+      values: [A, B, null, D]
+    - key: number
+      values: [1, 2, 3]
+      paired:
+          - key: [extra, filename]
+            values: [[foo, txt], [bar, md], [baz, rst]]
+extra_parameters:
+    git_branch: [master, dev/feature]
+    repetitions: 2
+"""
+
+BASE_CONFIG = {
+    'message': 'this is important',
+    'number': 1,
+    'extra': {'filename': ['foo', 'txt']}
+}
+
+
+def test_schedule_order():
+    config = validate(yaml.full_load(CONFIG))
+
+    envs = list(iter_environments(config, BASE_CONFIG))
+    assert len(envs) == count_environments(config) == 4 * 3 * 2 * 2
+
+    target_dir, cur_conf, extra_info = envs[0]
+    assert target_dir == (
+        'run.message=A,number=1,git_branch=master,repetition=1')
+    assert cur_conf == {**BASE_CONFIG, 'message': 'A'}
+    assert extra_info == {'git_branch': 'master'}
+
+    target_dir, cur_conf, extra_info = envs[-1]
+    assert target_dir == (
+        'run.message=D,number=3,git_branch=dev_feature,repetition=2')
+    assert cur_conf == {
+        'message': 'D', 'number': 3, 'extra': {'filename': ['baz', 'rst']}}
+    assert extra_info == {'git_branch': 'dev/feature'}
+
+    # base config is not modified
+    assert BASE_CONFIG['message'] == 'this is important'
+
+
+def test_schedule_slicing():
+    config = validate(yaml.full_load(CONFIG))
+    envs = list(iter_environments(config, BASE_CONFIG))
+
+    for start, stop in [(0, 5), (3, 17), (7, None), (None, 1), (-3, None)]:
+        sliced = list(iter_environments(
+            config, BASE_CONFIG, start=start, stop=stop))
+        assert sliced == envs[start:stop]
+        assert len(sliced) == count_environments(
+            config, start=start, stop=stop)
+
+
+def test_count():
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        with open('config.yaml', 'w') as fd:
+            fd.write(CONFIG)
+
+        result = runner.invoke(cli, ['build', '--count'])
+        assert result.exit_code == 0
+        assert result.output == '48\n'
+
+        result = runner.invoke(
+            cli, ['build', '--count', '--start', '40', '--stop', '100'])
+        assert result.output == '8\n'
+
+
+def test_structural_sharing():
+    config = validate(yaml.full_load("""
+project_source: fubar
+working_dir: tmp
+base_config: my_conf.yaml
+config_parameters:
+    - key: [model, rate]
+      values: [0.1, 0.2]
+      paired:
+          - key: [model, name]
+            values: [a, b]
+    """))
+    base_config = {
+        'model': {'rate': 0.5, 'name': 'x', 'layers': {'n': 3}},
+        'data': {'array': list(range(1000))}
+    }
+
+    envs = list(iter_environments(config, base_config))
+    assert [conf['model']['rate'] for _, conf, _ in envs] == [0.1, 0.2]
+    assert [conf['model']['name'] for _, conf, _ in envs] == ['a', 'b']
+
+    for _, conf, _ in envs:
+        # modified path is copied, everything else is shared
+        assert conf['model'] is not base_config['model']
+        assert conf['model']['layers'] is base_config['model']['layers']
+        assert conf['data'] is base_config['data']
+
+    assert base_config['model'] == {
+        'rate': 0.5, 'name': 'x', 'layers': {'n': 3}}
+
+
+def test_validation():
+    base_config = {
+        'model': {'rate': 0.5, 'layers': [{'n': 1}, {'n': 2}]},
+        'name': 'x'
+    }
+
+    def make_config(key, values):
+        return validate({
+            'project_source': 'fubar',
+            'working_dir': 'tmp',
+            'base_config': 'my_conf.yaml',
+            'config_parameters': [{'key': key, 'values': values}]
+        })
+
+    # valid keys
+    validate_schedule(make_config(['model', 'rate'], [1, 2]), base_config)
+    validate_schedule(
+        make_config(['model', 'layers', 0, 'n'], [3]), base_config)
+    validate_schedule(
+        make_config('model', [{'rate': 1, 'layers': []}]), base_config)
+
+    # invalid keys
+    for key, values in [
+        (['model', 'rat'], [1]),
+        (['modell', 'rate'], [1]),
+        ('model', [{'rate': 1}]),
+        ('name', [{'first': 'x'}]),
+    ]:
+        with pytest.raises(RuntimeError, match='Generated config is invalid'):
+            validate_schedule(make_config(key, values), base_config)
+
+    # keys must not pass through values other than dicts (or lists)
+    with pytest.raises(
+        RuntimeError, match=r'Invalid key "name\+first": "name" is not a dict'
+    ):
+        validate_schedule(make_config(['name', 'first'], [1]), base_config)
+
+
+def test_schedule_indices():
+    config = validate(yaml.full_load(CONFIG))
+    all_envs = list(iter_environments(config, BASE_CONFIG))
+
+    # select parameter combinations by their index along each dimension
+    spec_idx = get_spec_index(get_dimensions(config), [3, 1, 0])
+    envs = list(iter_environments(config, BASE_CONFIG, indices=[spec_idx]))
+    assert envs == all_envs[2 * spec_idx:2 * spec_idx + 2]
+    assert [target_dir for target_dir, _, _ in envs] == (
+        get_target_dirs(config, spec_idx)) == [
+        'run.message=D,number=2,git_branch=master,repetition=1',
+        'run.message=D,number=2,git_branch=master,repetition=2']
@@ -0,0 +1,63 @@
+import pytest
+
+from ..tables import read_npy, write_table
+
+
+ROWS = [
+    {'rate': 1, 'name': 'a', 'loss': 0.5, 'done': True},
+    {'rate': 2, 'name': None, 'loss': 1, 'done': False},
+    {'rate': 3, 'name': 'ccc', 'extra': [1, 2]}
+]
+
+EXPECTED = [
+    {'rate': 1, 'name': 'a', 'loss': 0.5, 'done': True, 'extra': None},
+    {'rate': 2, 'name': None, 'loss': 1.0, 'done': False, 'extra': None},
+    {'rate': 3, 'name': 'ccc', 'loss': None, 'done': None,
+     'extra': '[1, 2]'}
+]
+
+
+def test_write_parquet(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    fname = str(tmp_path / 'results.parquet')
+    write_table(iter(ROWS), fname, table_type='parquet', chunk_size=2)
+
+    table = pq.read_table(fname)
+    assert table.column_names == ['rate', 'name', 'loss', 'done', 'extra']
+    assert str(table.schema.field('rate').type) == 'int64'
+    assert table.to_pylist() == EXPECTED
+
+
+def test_write_hdf5(tmp_path):
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('tables')
+
+    fname = str(tmp_path / 'results.h5')
+    write_table(iter(ROWS), fname, table_type='hdf5', chunk_size=2)
+
+    df = pd.read_hdf(fname, 'results')
+    assert list(df.columns) == ['rate', 'name', 'loss', 'done', 'extra']
+    assert df['rate'].tolist() == [1, 2, 3]
+    assert df['name'].tolist() == ['a', '', 'ccc']
+    assert df['loss'].tolist()[:2] == [0.5, 1.0]
+    assert pd.isna(df['loss'].tolist()[2])
+
+    # missing booleans are stored as floats
+    assert df['done'].tolist()[:2] == [1.0, 0.0]
+    assert pd.isna(df['done'].tolist()[2])
+
+
+def test_read_npy(tmp_path):
+    np = pytest.importorskip('numpy')
+
+    fname = str(tmp_path / 'values.npy')
+    np.save(fname, np.array([[1, 2], [3, 4]]))
+    assert list(read_npy(fname)) == [
+        {'value_0': 1, 'value_1': 2}, {'value_0': 3, 'value_1': 4}]
+
+    arr = np.zeros(2, dtype=[('step', 'i8'), ('loss', 'f8')])
+    arr['step'] = [1, 2]
+    np.save(fname, arr)
+    assert list(read_npy(fname)) == [
+        {'step': 1, 'loss': 0.0}, {'step': 2, 'loss': 0.0}]
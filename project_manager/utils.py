@@ -1,3 +1,10 @@
+import os
+import copy
+import json
+import shutil
+import socket
+import uuid
+import hashlib
 import operator
 import functools
 
@@ -5,6 +12,10 @@ import yaml
 
 from .config_validation import main as validate
 
+# use libyaml if available
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
 
 SECTION_SEPARATOR = '.'
 PARAMETER_SEPARATOR = ','
@@ -12,13 +23,230 @@ NESTED_PARAMETER_SEPARATOR = '+'
 PARAMETER_ASSIGNMENT = '='
 
 TEMP_CONFIG_NAME = '.project_manager_config.yaml'
+STATUS_NAME = '.project_manager_status.json'
+LOG_NAME = '.project_manager_run.log'
+GATHER_MANIFEST_NAME = '.project_manager_gather.json'
+CLAIM_NAME = '.project_manager_claim'
+SOURCE_NAME = '.project_manager_source.json'
+META_DIR_NAME = '.project_manager'
+GIT_CACHE_DIR = os.path.join(META_DIR_NAME, 'git_cache')
+INDEX_PATH = os.path.join(META_DIR_NAME, 'index.sqlite')
+JOBS_DIR = os.path.join(META_DIR_NAME, 'jobs')
 
 
-def load_config(fname):
+FICLONE = 0x40049409  # linux ioctl for copy-on-write clones
+
+
+def load_yaml(fname):
     with open(fname) as fd:
-        config = yaml.full_load(fd)
+        return yaml.load(fd, Loader=YamlLoader)
+
+
+def dump_yaml(data, fname):
+    with open(fname, 'w') as fd:
+        yaml.dump(data, fd, Dumper=YamlDumper, default_flow_style=False)
+
+
+def load_config(fname):
+    return validate(load_yaml(fname))
+
+
+def load_config_file(fname):
+    # project configs can have any format supported by anyconfig
+    if os.path.splitext(fname)[1].lower() in ('.yaml', '.yml'):
+        return load_yaml(fname)
+
+    import anyconfig
+    return anyconfig.load(fname)
+
+
+def dump_config_file(data, fname):
+    if os.path.splitext(fname)[1].lower() in ('.yaml', '.yml'):
+        dump_yaml(data, fname)
+    else:
+        import anyconfig
+        anyconfig.dump(data, fname)
+
+
+def load_env_config(fname):
+    """Load config of an environment, which must not be modified as it
+    is shared between calls until the file changes."""
+    stat = os.stat(fname)
+    return _load_env_config(fname, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=2**16)
+def _load_env_config(fname, mtime, size):
+    return load_config_file(fname)
+
+
+def get_config_name(config):
+    return (TEMP_CONFIG_NAME
+            if config['base_config'] is None
+            else os.path.basename(config['base_config']))
+
+
+def list_environments(working_dir):
+    return sorted(
+        (entry
+         for entry in os.scandir(working_dir)
+         if entry.name.startswith(f'run{SECTION_SEPARATOR}')
+         and entry.is_dir()),
+        key=lambda entry: entry.name)
+
+
+def read_status(env_path):
+    try:
+        with open(os.path.join(env_path, STATUS_NAME)) as fd:
+            return json.load(fd)
+    except FileNotFoundError:
+        return None
+
+
+def write_status(env_path, status):
+    status_path = os.path.join(env_path, STATUS_NAME)
+    with open(f'{status_path}.tmp', 'w') as fd:
+        json.dump(status, fd, indent=1)
+    os.replace(f'{status_path}.tmp', status_path)
+
+
+def get_claim_owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
 
-    return validate(config)
+def claim_environment(env_path):
+    # atomically create claim file, fails if it already exists
+    claim_path = os.path.join(env_path, CLAIM_NAME)
+    try:
+        fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return _take_over_claim(env_path, claim_path)
+
+    with os.fdopen(fd, 'w') as claim_fd:
+        claim_fd.write(get_claim_owner())
+    return True
+
+
+def _take_over_claim(env_path, claim_path):
+    try:
+        import fcntl
+        claim_fd = open(claim_path)
+    except ImportError:
+        return False
+    except FileNotFoundError:
+        # claim was released in the meantime
+        return claim_environment(env_path)
+
+    with claim_fd:
+        # only one process at a time may replace the claim
+        fcntl.flock(claim_fd, fcntl.LOCK_EX)
+        try:
+            stat = os.stat(claim_path)
+        except FileNotFoundError:
+            return claim_environment(env_path)
+        claim_stat = os.fstat(claim_fd.fileno())
+        if (stat.st_dev, stat.st_ino) != (
+            claim_stat.st_dev, claim_stat.st_ino
+        ):
+            # claim was replaced while waiting for the lock
+            return claim_environment(env_path)
+
+        # take over claims of dead processes on this host
+        host, _, pid = claim_fd.read().partition(':')
+        if host != socket.gethostname() or _pid_exists(int(pid or 0)):
+            return False
+
+        tmp_path = f'{claim_path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as fd:
+            fd.write(get_claim_owner())
+        os.replace(tmp_path, claim_path)
+    return True
+
+
+def release_environment(env_path):
+    # claims of other processes are kept
+    claim_path = os.path.join(env_path, CLAIM_NAME)
+    try:
+        with open(claim_path) as fd:
+            owner = fd.read()
+    except FileNotFoundError:
+        return
+
+    if owner == get_claim_owner():
+        os.remove(claim_path)
+
+
+def _pid_exists(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def fingerprint(obj):
+    data = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def hash_file(fname, chunk_size=2**20):
+    sha = hashlib.sha1()
+    with open(fname, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hardlink_file(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. across filesystems
+        shutil.copy2(src, dst)
+
+
+def reflink_file(src, dst):
+    try:
+        import fcntl
+        with open(src, 'rb') as fd_src, open(dst, 'wb') as fd_dst:
+            fcntl.ioctl(fd_dst.fileno(), FICLONE, fd_src.fileno())
+        shutil.copystat(src, dst)
+    except (ImportError, OSError):
+        # filesystem (or platform) does not support copy-on-write
+        shutil.copy2(src, dst)
+
+
+def symlink_file(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+
+def copy_tree(src, dst, link_mode='copy', count_bytes=False):
+    """Copy `src` to `dst`, returns the number of bytes copied if
+    `count_bytes` is set (links, including reflinks, count as zero)."""
+    copy_function = {
+        'copy': shutil.copy2,
+        'hardlink': hardlink_file,
+        'reflink': reflink_file,
+        'symlink-readonly': symlink_file
+    }[link_mode]
+
+    copied = 0
+
+    def count_copy(src_file, dst_file):
+        nonlocal copied
+        dst_file = shutil.copy2(src_file, dst_file)
+        copied += os.path.getsize(dst_file)
+        return dst_file
+
+    if count_bytes and link_mode == 'copy':
+        copy_function = count_copy
+
+    shutil.copytree(src, dst, copy_function=copy_function)
+    return copied
 
 
 def get_by_keylist(root, items):
@@ -36,6 +264,22 @@ def assign_to_dict(dict_, key, value):
         dict_[key] = value
 
 
+def assign_to_dict_shared(dict_, key, value, owned):
+    # copy only the containers along the path of `key` (unless they have
+    # already been copied, i.e. are in `owned`) and share all others
+    keys = key if isinstance(key, list) else [key]
+
+    node = dict_
+    for k in keys[:-1]:
+        child = node[k]
+        if id(child) not in owned:
+            child = copy.copy(child)
+            owned.add(id(child))
+            node[k] = child
+        node = child
+    node[keys[-1]] = value
+
+
 def dict_to_keyset(d):
     all_keys = set()
     for k, v in d.items():
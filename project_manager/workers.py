@@ -0,0 +1,119 @@
+"""
+Long-lived worker processes which call a Python entry point per environment.
+
+The module of the entry point (`module:function`) is imported only once per
+worker, and workers are replaced after a fixed number of environments to
+bound the effect of leaks.
+"""
+
+import os
+import sys
+import asyncio
+import importlib
+import traceback
+import contextlib
+import multiprocessing
+
+
+_entry_functions = {}
+
+
+def load_entry(entry: str, path: str):
+    if entry not in _entry_functions:
+        module_name, _, function_name = entry.partition(':')
+
+        # the module is usually part of the (copied) project
+        sys.path.insert(0, path)
+        try:
+            module = importlib.import_module(module_name)
+        finally:
+            sys.path.remove(path)
+
+        _entry_functions[entry] = getattr(module, function_name)
+    return _entry_functions[entry]
+
+
+@contextlib.contextmanager
+def redirect_output(log_fd):
+    # redirect on the file descriptor level to also capture output of
+    # extension modules
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    os.dup2(log_fd.fileno(), 1)
+    os.dup2(log_fd.fileno(), 2)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved_fd in zip((1, 2), saved):
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+
+
+@contextlib.contextmanager
+def visible_gpus(gpu_ids):
+    # workers are reused, so later environments must not inherit the GPUs
+    # of earlier ones; note that CUDA only reads the variable when it is
+    # initialised, so a worker keeps the GPUs of its first environment
+    # which uses CUDA
+    saved = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if gpu_ids is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ','.join(gpu_ids)
+    try:
+        yield
+    finally:
+        if saved is None:
+            os.environ.pop('CUDA_VISIBLE_DEVICES', None)
+        else:
+            os.environ['CUDA_VISIBLE_DEVICES'] = saved
+
+
+def call_entry(
+    entry: str, path: str, cur_config: dict, log_path: str,
+    gpu_ids: list = None
+) -> int:
+    cwd = os.getcwd()
+    path = os.path.abspath(path)
+    with open(log_path, 'ab') as log_fd, redirect_output(log_fd):
+        with visible_gpus(gpu_ids):
+            os.chdir(path)
+            try:
+                load_entry(entry, path)(cur_config)
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    return e.code or 0
+                print(e.code, file=sys.stderr)
+                return 1
+            except Exception:
+                traceback.print_exc()
+                return 1
+            finally:
+                os.chdir(cwd)
+    return 0
+
+
+def create_pool(processes: int, max_tasks: int):
+    # forking a process with running threads is unsafe
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(processes, maxtasksperchild=max_tasks)
+
+
+async def submit(pool, *args) -> int:
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def set_result(result):
+        if not future.done():
+            future.set_result(result)
+
+    def set_exception(exc):
+        if not future.done():
+            future.set_exception(exc)
+
+    pool.apply_async(
+        call_entry, args,
+        callback=lambda r: loop.call_soon_threadsafe(set_result, r),
+        error_callback=lambda e: loop.call_soon_threadsafe(set_exception, e))
+    return await future